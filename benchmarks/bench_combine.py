@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# bench_combine.py - times loading the config, combine() with various filter
+# settings, to_html() and the command line tool on a synthetic site (see
+# sitegen.py), and measures their memory use. Runs offline; results can be
+# saved as JSON and compared against the results of another commit.
+#
+# Usage: python benchmarks/bench_combine.py [--pages N] [--repeat N]
+#            [--json FILE] [--compare FILE] [--threshold PERCENT]
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmark the source tree this script is in, installed or not (the command
+# line tool runs with it on PYTHONPATH too)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sitegen  # noqa: E402
+from mkdocs_combine import MkDocsCombiner  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Filter settings to time combine() with. "cli" matches the defaults of the
+# command line tool.
+COMBINATIONS = {
+    "cli": {"filter_tables": False, "convert_math": False},
+    "minimal": {
+        "filter_tables": False,
+        "filter_xrefs": False,
+        "strip_anchors": False,
+        "convert_math": False,
+        "add_chapter_heads": False,
+        "increase_heads": False,
+    },
+    "grid": {"filter_tables": True, "convert_math": False},
+    "latex": {"filter_tables": False, "convert_math": True},
+    "admonitions": {
+        "filter_tables": False,
+        "convert_math": False,
+        "convert_admonition_md": True,
+    },
+    "resolve": {"filter_tables": False, "convert_math": False, "resolve_xrefs": True},
+    "all": {
+        "filter_tables": True,
+        "convert_math": True,
+        "convert_admonition_md": True,
+        "image_ext": "jpg",
+        "add_page_break": True,
+    },
+}
+
+CLI = "import sys; from mkdocs_combine.cli.mkdocscombine import main; sys.exit(main())"
+
+
+def best(func, repeat):
+    """Returns the shortest of `repeat` run times of func() and its result"""
+    times = []
+    result = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def peak(func):
+    """Returns the peak memory allocated by Python objects during func()"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_combine(config_file, repeat):
+    """Times combine() (without loading the config) for each combination of
+    filter settings"""
+    results = {}
+    for name, flags in COMBINATIONS.items():
+        c = MkDocsCombiner(config_file=config_file, **flags)
+        seconds, lines = best(c.combine, repeat)
+        results[f"combine/{name}"] = {
+            "seconds": seconds,
+            "peak_kb": peak(c.combine) // 1024,
+            "lines": len(lines),
+        }
+    return results
+
+
+def bench_config(config_file, repeat):
+    seconds, c = best(lambda: MkDocsCombiner(config_file=config_file), repeat)
+    return {"config": {"seconds": seconds}}
+
+
+def to_html(c):
+    """to_html() without the benefit of chunks rendered by earlier runs"""
+    c.html_renderer = None
+    return c.to_html()
+
+
+def bench_html(config_file, repeat):
+    """Times to_html() from scratch and after changing one line in the middle
+    of the document (which only renders that page again)"""
+    c = MkDocsCombiner(config_file=config_file, **COMBINATIONS["cli"])
+    lines = c.combine()
+    seconds, html = best(lambda: to_html(c), repeat)
+    results = {
+        "to_html": {
+            "seconds": seconds,
+            "peak_kb": peak(lambda: to_html(c)) // 1024,
+            "bytes": len(html),
+        }
+    }
+
+    middle = len(lines) // 2
+
+    def change_one_line():
+        lines[middle] += " changed"
+        return c.to_html()
+
+    seconds, html = best(change_one_line, repeat)
+    results["to_html/one-change"] = {"seconds": seconds, "bytes": len(html)}
+    return results
+
+
+def bench_cli(config_file, repeat):
+    """Times the command line tool in fresh interpreters: just starting up
+    (--version) and combining the site"""
+    commands = {
+        "cli/startup": [sys.executable, "-c", CLI, "--version"],
+        "cli/combine": [
+            sys.executable,
+            "-c",
+            CLI,
+            "-f",
+            config_file,
+            "-o",
+            os.devnull,
+            "--no-cache",
+        ],
+    }
+    path = os.environ.get("PYTHONPATH")
+    env = dict(os.environ, PYTHONPATH=ROOT + (os.pathsep + path if path else ""))
+    results = {}
+    for name, command in commands.items():
+        seconds, rc = best(
+            lambda: subprocess.call(
+                command,
+                cwd=os.path.dirname(config_file),
+                env=env,
+                stdout=subprocess.DEVNULL,
+            ),
+            repeat,
+        )
+        results[name] = {"seconds": seconds, "status": rc}
+
+    if resource is not None:
+        # Largest resident set of all the runs above (kB on Linux)
+        results["cli/combine"]["maxrss_kb"] = resource.getrusage(
+            resource.RUSAGE_CHILDREN
+        ).ru_maxrss
+    return results
+
+
+def commit():
+    """Returns the current git commit of the source tree, if any"""
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """Prints the results next to those of an earlier run. Returns the number
+    of timings that got slower by more than `threshold` percent."""
+    if old["meta"]["site"] != new["meta"]["site"]:
+        print("warning: the results are for different sites", file=sys.stderr)
+
+    regressions = 0
+    print(f"\n{'benchmark':<22} {'before s':>10} {'after s':>10} {'change':>8}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if not before:
+            continue
+        change = 100.0 * (result["seconds"] / before["seconds"] - 1)
+        flag = ""
+        if change > threshold:
+            flag = " REGRESSION"
+            regressions += 1
+        print(
+            f"{name:<22} {before['seconds']:>10.4f} {result['seconds']:>10.4f} "
+            f"{change:>+7.1f}%{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mkdocs-combine benchmarks")
+    sitegen.add_arguments(parser)
+    parser.add_argument("--repeat", default=5, type=int, help="(default: 5)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with results from this file")
+    parser.add_argument(
+        "--threshold",
+        default=20.0,
+        type=float,
+        help="slowdown in percent reported as a regression (default: 20)",
+    )
+    parser.add_argument(
+        "--no-cli", action="store_true", help="skip the command line benchmarks"
+    )
+    args = parser.parse_args()
+    site = {name: getattr(args, name) for name in sitegen.DEFAULTS}
+
+    with tempfile.TemporaryDirectory() as root:
+        config_file = sitegen.generate(root, **site)
+        results = {}
+        results.update(bench_config(config_file, args.repeat))
+        results.update(bench_combine(config_file, args.repeat))
+        results.update(bench_html(config_file, args.repeat))
+        if not args.no_cli:
+            results.update(bench_cli(config_file, args.repeat))
+
+    report = {
+        "meta": {
+            "commit": commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "site": site,
+        },
+        "results": results,
+    }
+
+    print(f"{'benchmark':<22} {'seconds':>10} {'peak kB':>10}")
+    for name, result in results.items():
+        print(f"{name:<22} {result['seconds']:>10.4f} {result.get('peak_kb', ''):>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        if compare(old, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
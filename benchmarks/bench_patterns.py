@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# bench_patterns.py - per-line throughput of the line filters with string
+# patterns (as the filters used to call them) and with the precompiled
+# patterns from mkdocs_combine.filters.patterns
+#
+# Usage: python benchmarks/bench_patterns.py [number of lines]
+
+import os
+import re
+import sys
+import time
+
+# Benchmark the source tree this script is in, installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkdocs_combine.filters import (  # noqa: E402
+    anchors,
+    exclude,
+    headlevels,
+    math,
+    metadata,
+    toc,
+    xref,
+)
+
+SAMPLE = [
+    "# A heading",
+    "Some prose with <a name='x'></a> an anchor and \\(x^2\\) math.",
+    "A [cross reference](other.md#section) and [another](page.md) one.",
+    "{!macros.md!} pulled in by every page",
+    "    [TOC]",
+    "key: value",
+    "Plain text without anything special in it at all.",
+]
+
+EXCLUDE = ["macros.md", "footer.md", "header.md"]
+
+
+def string_patterns():
+    """The filters as they were before the patterns were precompiled"""
+
+    def anchor(line):
+        return re.sub(r"<a.*?</a>", "", line)
+
+    def mathf(line):
+        return re.sub(r"\\\((.*)\\\)", r"$\1$", line)
+
+    def tocf(line):
+        return re.sub(r"^\s*\[TOC\]\s*", "", line)
+
+    def headlevel(line):
+        line = re.sub(r"^#", "##", line)
+        return re.sub(r"^#######+", "######", line)
+
+    def meta(line):
+        # The whole of run(), like the compiled side
+        ret = []
+        header = True
+        for each in [line]:
+            if header:
+                if not re.match(r"^[a-zA-Z\ ]:", each):
+                    header = False
+                    ret.append(each)
+            else:
+                ret.append(each)
+        return ret
+
+    def excl(line):
+        for name in EXCLUDE:
+            line = re.sub(r"\{!%s!\}" % name, "", line)
+        return line
+
+    def xreff(line):
+        while True:
+            match = re.search(r"[^!]\[([^\]]+?)\]\(([^http].*?)\)", line)
+            if match is None:
+                return line
+            line = re.sub(
+                r"[^!]\[[^\]]+?\]\([^http].*?\)", match.group(1), line, count=1
+            )
+
+    return [
+        ("AnchorFilter", anchor),
+        ("MathFilter", mathf),
+        ("TocFilter", tocf),
+        ("HeadlevelFilter", headlevel),
+        ("MetadataFilter", meta),
+        ("ExcludeFilter", excl),
+        ("XrefFilter", xreff),
+    ]
+
+
+def compiled_patterns():
+    """The filters as they are now, one line at a time"""
+    f_headlevel = headlevels.HeadlevelFilter([{"level": 2}])
+    f_exclude = exclude.ExcludeFilter(exclude=EXCLUDE)
+    f_metadata = metadata.MetadataFilter()
+    return [
+        ("AnchorFilter", anchors.AnchorFilter().filter_line),
+        ("MathFilter", math.MathFilter().filter_line),
+        ("TocFilter", toc.TocFilter().filter_line),
+        ("HeadlevelFilter", lambda line: f_headlevel.run([line])),
+        ("MetadataFilter", lambda line: f_metadata.run([line])),
+        ("ExcludeFilter", lambda line: f_exclude.run([line])),
+        ("XrefFilter", xref.XrefFilter().filter_line),
+    ]
+
+
+def throughput(func, lines, repeat=3):
+    """Lines per second of the best of `repeat` runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(lines) / best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lines = (SAMPLE * (count // len(SAMPLE) + 1))[:count]
+
+    print(f"{'filter':<16} {'before lines/s':>15} {'after lines/s':>15} {'speedup':>8}")
+    for (name, before), (_, after) in zip(string_patterns(), compiled_patterns()):
+        b = throughput(before, lines)
+        a = throughput(after, lines)
+        print(f"{name:<16} {b:>15,.0f} {a:>15,.0f} {a / b:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
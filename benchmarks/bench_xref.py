@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# bench_xref.py - XrefFilter on synthetic link-heavy pages: the former
+# search-and-substitute loop against the current single-pass substitution
+#
+# Usage: python benchmarks/bench_xref.py [number of lines]
+
+import os
+import sys
+import time
+
+# Benchmark the source tree this script is in, installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkdocs_combine.filters import patterns, xref  # noqa: E402
+
+
+def rescanning_filter_line(line):
+    """XrefFilter.filter_line() as it was: rescans the line from the start
+    after each replaced cross-reference"""
+    while True:
+        match = patterns.XREF.search(line)
+        if match is None:
+            return line
+        line = patterns.XREF.sub(match.group(1), line, count=1)
+
+
+def page(lines, links):
+    """Returns the lines of an index-style page with `links` cross-references
+    per line"""
+    return [
+        " ".join(
+            f"see [entry {i}.{j}](section{j}/page{i}.md#anchor-{j}), "
+            for j in range(links)
+        )
+        + f"[ext](http://example.com/{i}) ![img](img{i}.png)"
+        for i in range(lines)
+    ]
+
+
+def timed(func, lines):
+    start = time.perf_counter()
+    result = [func(line) for line in lines]
+    return time.perf_counter() - start, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    f_xref = xref.XrefFilter()
+
+    print(f"{'links/line':>10} {'before s':>10} {'after s':>10} {'speedup':>8} same")
+    for links in (1, 5, 20, 50, 100):
+        lines = page(count, links)
+        before, expected = timed(rescanning_filter_line, lines)
+        after, result = timed(f_xref.filter_line, lines)
+        print(
+            f"{links:>10} {before:>10.3f} {after:>10.3f} {before / after:>7.1f}x "
+            f"{result == expected}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# sitegen.py - generates synthetic MkDocs sites for the benchmarks. The same
+# parameters always produce the same site.
+#
+# Usage: python benchmarks/sitegen.py DIRECTORY [--pages N] [--depth N] ...
+
+import argparse
+import os
+import random
+
+import yaml
+
+# Parameters of the generated site and their defaults (per page, except for
+# pages and depth)
+DEFAULTS = {
+    "pages": 100,
+    "depth": 2,
+    "sections": 6,
+    "tables": 1,
+    "images": 2,
+    "links": 4,
+    "admonitions": 1,
+    "math": 2,
+    "includes": 1,
+    "seed": 0,
+}
+
+SNIPPETS = 5
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam "
+    "quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo"
+).split()
+
+
+def words(rnd, count):
+    return " ".join(rnd.choice(WORDS) for i in range(count))
+
+
+def page_path(i, depth):
+    """Returns the path of page `i`: pages are spread over `depth` levels of
+    directories with three entries each"""
+    parts = []
+    n = i
+    for level in range(depth):
+        parts.append(f"part{n % 3}")
+        n //= 3
+    return "/".join(parts + [f"page{i:05d}.md"])
+
+
+def relative(source, target):
+    return os.path.relpath(target, os.path.dirname(source) or ".").replace(os.sep, "/")
+
+
+def page(rnd, i, paths, params):
+    """Returns the Markdown source of page `i`"""
+    path = paths[i]
+    lines = [f"# Page {i}", ""]
+    for s in range(params["sections"]):
+        lines.append(f"## Section {s}")
+        lines.append("")
+
+        text = [words(rnd, 12)]
+        if s < params["links"]:
+            j = rnd.randrange(len(paths))
+            target = relative(path, paths[j])
+            text.append(f"see [page {j}]({target}#section-{rnd.randrange(3)}) and")
+        if s < params["math"]:
+            text.append(f"\\(x_{s}^2 + y_{s}\\) with")
+        if s < params["images"]:
+            text.append(f"![figure {s}](img/figure{s}.png)")
+        text.append(f'<a name="p{i}s{s}"></a>{words(rnd, 20)}.')
+        lines.append(" ".join(text))
+        lines.append("")
+
+        if s < params["tables"]:
+            lines.append("| Name | Value | Description | Link |")
+            lines.append("|------|------:|:------------|------|")
+            for r in range(5):
+                lines.append(
+                    f"| row {r} | {rnd.randrange(1000)} | {words(rnd, rnd.randrange(3, 15))} "
+                    f"| [page {r}]({relative(path, paths[r % len(paths)])}) |"
+                )
+            lines.append("")
+
+        if s < params["admonitions"]:
+            lines.append('!!! note "Note"')
+            lines.append(f"    {words(rnd, 15)}")
+            lines.append("")
+
+        if s < params["includes"]:
+            lines.append(f"{{!inc/snippet{rnd.randrange(SNIPPETS)}.md!}}")
+            lines.append("")
+
+        if s == 0:
+            lines.append("```")
+            lines.append("# not a heading")
+            lines.append("```")
+            lines.append("")
+
+    return "\n".join(lines) + "\n"
+
+
+def nav(paths):
+    """Returns the nav of the site: one section per directory, recursively"""
+    tree = {}
+    for i, path in enumerate(paths):
+        node = tree
+        for part in path.split("/")[:-1]:
+            node = node.setdefault(part, {})
+        node[f"Page {i}"] = path
+
+    def entries(node):
+        result = []
+        for title, value in node.items():
+            if isinstance(value, dict):
+                result.append({title.capitalize(): entries(value)})
+            else:
+                result.append({title: value})
+        return result
+
+    return entries(tree)
+
+
+def generate(root, **params):
+    """Writes a synthetic site to the directory `root` and returns the path of
+    its mkdocs.yml. See DEFAULTS for the parameters."""
+    params = dict(DEFAULTS, **params)
+    rnd = random.Random(params["seed"])
+    docs_dir = os.path.join(root, "docs")
+    paths = [page_path(i, params["depth"]) for i in range(params["pages"])]
+
+    for i, path in enumerate(paths):
+        fname = os.path.join(docs_dir, path)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "w", encoding="utf-8") as f:
+            f.write(page(rnd, i, paths, params))
+
+    os.makedirs(os.path.join(docs_dir, "inc"), exist_ok=True)
+    for k in range(SNIPPETS):
+        with open(
+            os.path.join(docs_dir, "inc", f"snippet{k}.md"), "w", encoding="utf-8"
+        ) as f:
+            f.write(f"Snippet {k}: {words(rnd, 10)}\n")
+
+    config = {
+        "site_name": "Synthetic benchmark site",
+        "markdown_extensions": [
+            "toc",
+            "admonition",
+            "tables",
+            "markdown_include.include",
+        ],
+        "nav": nav(paths),
+    }
+    config_file = os.path.join(root, "mkdocs.yml")
+    with open(config_file, "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, default_flow_style=False, sort_keys=False)
+
+    return config_file
+
+
+def add_arguments(parser):
+    """Adds an option for each site parameter to an argparse parser"""
+    for name, default in DEFAULTS.items():
+        parser.add_argument(
+            f"--{name}", dest=name, default=default, type=int, help=f"(default: {default})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generates a synthetic MkDocs site")
+    parser.add_argument("directory")
+    add_arguments(parser)
+    args = vars(parser.parse_args())
+    print(generate(args.pop("directory"), **args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# aio.py - combines and renders without blocking an asyncio event loop
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Stops the blocking part of a build whose task was cancelled"""
+
+
+def checked(lines, stop, every=1024):
+    """Passes `lines` through, raising Cancelled once the threading.Event
+    `stop` is set (checked every `every` lines)"""
+    for i, line in enumerate(lines):
+        if not i % every and stop.is_set():
+            raise Cancelled()
+        yield line
+
+
+async def run_blocking(func, *args, stop=None, executor=None):
+    """Runs func(*args) in `executor` (default: the loop's thread pool). If
+    the awaiting task is cancelled, sets the threading.Event `stop` (which
+    func should check) and waits for func to return before passing the
+    cancellation on, so a cancelled build leaves nothing running behind."""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, func, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if stop is not None:
+            stop.set()
+        await asyncio.wait([future])
+        if not future.cancelled():
+            future.exception()
+        raise
+
+
+async def gather_in_order(aws, on_result=None, limit=None):
+    """Runs the awaitables `aws` concurrently and returns their results in
+    order, calling on_result(index, result) for each as soon as it and all
+    results before it are in. With `limit` set, at most `limit` of them run
+    at a time: the next one starts when the first one still running is done
+    (pass an iterator creating them lazily). Cancels the ones still pending
+    if one fails or the awaiting task is cancelled."""
+    aws = iter(aws)
+    pending = collections.deque(
+        asyncio.ensure_future(aw) for aw in itertools.islice(aws, limit)
+    )
+    results = []
+    try:
+        while pending:
+            result = await pending[0]
+            pending.popleft()
+            for aw in itertools.islice(aws, 1):
+                pending.append(asyncio.ensure_future(aw))
+            if on_result is not None:
+                on_result(len(results), result)
+            results.append(result)
+    finally:
+        for task in pending:
+            task.cancel()
+    return results
+
+
+async def combine(combiner, executor=None):
+    """MkDocsCombiner.combine() for asyncio: page files are read on the
+    loop's thread pool and filtered in `executor` (default: the loop's thread
+    pool; pass a ProcessPoolExecutor to filter on all cores), then the
+    filters over the whole document run on the loop's thread pool. Up to
+    `prefetch` pages (at least one) are read and filtered at a time.
+    Cancelling the task stops the build between pages and within the
+    document filters."""
+    loop = asyncio.get_running_loop()
+    pages = combiner.get_pages()
+    processor = combiner.page_processor(pages)
+    in_process = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+
+    async def process(page):
+        if in_process or not page["file"]:
+            # Worker processes read their pages themselves (memory-mapped
+            # page files can't be sent to them)
+            return await loop.run_in_executor(executor, processor.work, page)
+        start = time.perf_counter()
+        data = await loop.run_in_executor(None, processor.load, page)
+        io = time.perf_counter() - start
+        return await loop.run_in_executor(executor, processor.work, page, data, io)
+
+    def page_done(i, result):
+        lines, info = result
+        if in_process:
+            processor.include_stats.update(info["includes"])
+        combiner.page_done(pages[i], lines, info)
+
+    window = max(processor.prefetch, 1)
+    results = await gather_in_order(map(process, pages), page_done, window)
+    results = [lines for lines, info in results]
+
+    stop = threading.Event()
+
+    def filter_document(results):
+        if combiner.resolve_xrefs:
+            results = combiner.resolve_page_xrefs(pages, results)
+        if stop.is_set():
+            raise Cancelled()
+        chain = combiner.build_filter_chain()
+        lines = combiner.filter_document(chain, zip(pages, results))
+        lines = list(checked(lines, stop))
+        combiner.prune_cache()
+        return lines
+
+    combiner.combined_md_lines = await run_blocking(filter_document, results, stop=stop)
+    return combiner.combined_md_lines
+
+
+async def to_html(combiner, executor=None):
+    """MkDocsCombiner.to_html() for asyncio: the chunks that aren't cached
+    are rendered in `executor` (default: the loop's thread pool), everything
+    else runs on the loop's thread pool. Cancelling the task stops the
+    rendering between chunks."""
+    start = time.perf_counter()
+    renderer = await run_blocking(combiner.get_html_renderer)
+    stats = renderer.stats.copy()
+    keys, texts, references, results = await run_blocking(
+        renderer.prepare, combiner.combined_md_lines
+    )
+
+    missing = [texts[i] for i, result in enumerate(results) if result is None]
+    size = 1
+    if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        # A few batches per CPU, since each batch ships the renderer
+        size = max(1, len(missing) // ((os.cpu_count() or 1) * 4))
+    batches = [missing[i : i + size] for i in range(0, len(missing), size)]
+
+    loop = asyncio.get_running_loop()
+    wrap = len(texts) > 1
+    rendered = await gather_in_order(
+        loop.run_in_executor(
+            executor, renderer.convert_many, batch, references, wrap
+        )
+        for batch in batches
+    )
+    rendered = [result for batch in rendered for result in batch]
+
+    html_bare = await run_blocking(renderer.finish, keys, results, rendered)
+    if html_bare is None:
+        html_bare = await run_blocking(
+            renderer.render_whole, combiner.combined_md_lines
+        )
+    return combiner.set_html(html_bare, renderer.stats - stats, start)
+
+
+class LatestOnly:
+    """Runs one build at a time, cancelling the builds still running when a
+    new one comes in: for preview services, where only the latest request
+    for a site matters. A new build starts once the cancelled ones stopped,
+    so all builds can share one MkDocsCombiner."""
+
+    def __init__(self):
+        self.tasks = set()
+
+    async def run(self, func, *args):
+        """Cancels the builds still running, then returns the result of
+        `await func(*args)`. Raises asyncio.CancelledError if a later call
+        supersedes this one."""
+        previous = list(self.tasks)
+        for task in previous:
+            task.cancel()
+
+        async def start():
+            if previous:
+                await asyncio.wait(previous)
+            return await func(*args)
+
+        task = asyncio.ensure_future(start())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return await task
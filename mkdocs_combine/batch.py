@@ -0,0 +1,190 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# batch.py - combines many MkDocs sites in one interpreter
+
+import codecs
+import collections
+import importlib
+import itertools
+import os
+import shlex
+import time
+
+import mkdocs_combine.mkdocs_combiner
+from mkdocs_combine.cache import site_cache_dir
+from mkdocs_combine.exceptions import FatalError
+
+# Imported ahead of the first site by warm_up()
+WARM_UP_MODULES = [
+    "mkdocs.config",
+    "mkdocs.utils",
+    "mkdocs_combine.filters.admonitions",
+    "mkdocs_combine.filters.include",
+    "mkdocs_combine.filters.tables",
+]
+
+
+def default_outfile(config_file):
+    """Returns the output file of a site listed without one: its config file
+    with the extension .md (mkdocs.yml -> mkdocs.md)"""
+    return os.path.splitext(config_file)[0] + ".md"
+
+
+def read_site_list(path, encoding="utf-8"):
+    """Reads a list of sites: one site per line, given as the path of its
+    config file, optionally followed by the path of its output file (quoted
+    like in a shell if they contain spaces). Relative paths are relative to
+    the directory of the list. Empty lines and lines starting with # are
+    skipped. Returns a list of (config_file, outfile) tuples."""
+    try:
+        f = codecs.open(path, "r", encoding)
+    except OSError as e:
+        raise FatalError(f"Couldn't open {path} for reading: {e.strerror}", 1)
+
+    base = os.path.dirname(path)
+    sites = []
+    with f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                fields = shlex.split(line)
+            except ValueError as e:
+                raise FatalError(f"{path}:{number}: {e}", 1)
+            if len(fields) > 2:
+                raise FatalError(
+                    f"{path}:{number}: expected a config file and optionally "
+                    f"an output file, got {len(fields)} fields",
+                    1,
+                )
+            config_file = os.path.join(base, fields[0])
+            if len(fields) == 2:
+                outfile = os.path.join(base, fields[1])
+            else:
+                outfile = default_outfile(config_file)
+            sites.append((config_file, outfile))
+    return sites
+
+
+def warm_up():
+    """Imports MkDocs and the filters that are only imported on demand, so
+    that all the sites a process builds share them (initializer of the batch
+    worker processes)"""
+    for name in WARM_UP_MODULES:
+        importlib.import_module(name)
+
+
+def combine_site(config_file, outfile, options):
+    """Combines one site into `outfile`. `options` are passed to
+    MkDocsCombiner; a relative cache_dir is taken to be relative to the
+    site's config file. Returns a dict with the paths, the time the build
+    took, its include cache counters and, if it failed, the error message and
+    exit status."""
+    start = time.perf_counter()
+    result = {
+        "config_file": config_file,
+        "outfile": outfile,
+        "seconds": 0.0,
+        "includes": {},
+        "error": None,
+        "status": 0,
+    }
+
+    options = dict(options)
+    options["cache_dir"] = site_cache_dir(options.get("cache_dir"), config_file)
+
+    mkdocs_combiner = None
+    try:
+        mkdocs_combiner = mkdocs_combine.mkdocs_combiner.MkDocsCombiner(
+            config_file=config_file, **options
+        )
+        try:
+            f = codecs.open(outfile, "w", encoding=mkdocs_combiner.encoding)
+        except OSError as e:
+            raise FatalError(f"Couldn't open {outfile} for writing: {e.strerror}", 1)
+        with f:
+            mkdocs_combiner.combine_to(f)
+    except FatalError as e:
+        result["error"] = e.message
+        result["status"] = e.status
+    except Exception as e:
+        # A broken site must not take the rest of the batch down with it
+        result["error"] = f"{config_file}: {type(e).__name__}: {e}"
+        result["status"] = 1
+
+    if mkdocs_combiner is not None:
+        result["includes"] = dict(mkdocs_combiner.include_stats)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def combine_many(sites, jobs=1, pool="process", on_site=None, **kwargs):
+    """Combines many sites in one interpreter, one output file per site.
+    `sites` is a list of config files or (config_file, outfile) pairs (see
+    default_outfile() for sites without an output file); the other keyword
+    arguments are passed to MkDocsCombiner for every site.
+
+    With jobs > 1 (or 0/None for one job per CPU) the sites are built in
+    parallel on a process or thread pool, each worker importing MkDocs and
+    the filters once for all the sites it builds. The pages of a site are
+    then processed in a single job. Returns the results of combine_site() in
+    the order of `sites`; a site that fails doesn't stop the others. If
+    given, on_site(result) is called as each result comes in."""
+    sites = [
+        (site, default_outfile(site)) if isinstance(site, str) else tuple(site)
+        for site in sites
+    ]
+    config_files = [config_file for config_file, outfile in sites]
+    outfiles = [outfile for config_file, outfile in sites]
+
+    if jobs == 1 or len(sites) < 2:
+        results = map(combine_site, config_files, outfiles, itertools.repeat(kwargs))
+        return collect(results, on_site)
+
+    import concurrent.futures
+
+    workers = min(jobs or os.cpu_count() or 1, len(sites))
+    if pool == "thread":
+        warm_up()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=warm_up
+        )
+
+    with executor:
+        results = executor.map(
+            combine_site, config_files, outfiles, itertools.repeat(kwargs)
+        )
+        return collect(results, on_site)
+
+
+def collect(results, on_site=None):
+    collected = []
+    for result in results:
+        if on_site is not None:
+            on_site(result)
+        collected.append(result)
+    return collected
+
+
+def include_totals(results):
+    """Sums up the include cache counters of a batch"""
+    totals = collections.Counter()
+    for result in results:
+        totals.update(result["includes"])
+    return totals
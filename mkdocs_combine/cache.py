@@ -0,0 +1,213 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# cache.py - on-disk and in-memory cache for the output of the per-page filters
+
+import hashlib
+import json
+import os
+
+
+def package_version():
+    """Returns the installed version of mkdocs-combine (or "unknown")"""
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        # Python < 3.8
+        try:
+            from importlib_metadata import version
+        except ImportError:
+            return "unknown"
+
+    try:
+        return version("mkdocs-combine")
+    except Exception:
+        return "unknown"
+
+
+def site_cache_dir(cache_dir, config_file):
+    """Returns the cache directory `cache_dir` of the site of `config_file`: a
+    relative path is taken to be relative to the config file's directory"""
+    if cache_dir and not os.path.isabs(cache_dir):
+        return os.path.join(os.path.dirname(os.path.abspath(config_file)), cache_dir)
+    return cache_dir
+
+
+def file_stamp(path):
+    """Returns a cheap change indicator (mtime and size) for a file, or None if
+    the file does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class PageCache:
+    """Stores the lines each page has after the per-page filters ran, keyed by
+    the page's content hash, its position in the nav and the filter options.
+    Entries also record the files pulled in through includes so they can be
+    invalidated when one of those changes. With `memory` set, entries are kept
+    in memory as well (or only, if `cache_dir` is None) for the lifetime of
+    the cache object."""
+
+    def __init__(
+        self, cache_dir=".mkdocscombine-cache", max_size=256 * 1024 * 1024, memory=False
+    ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.version = package_version()
+        self.memory = {} if memory else None
+        self.used = set()
+
+    def __getstate__(self):
+        # Worker processes only use the on-disk cache; don't ship the memory
+        # cache to them.
+        state = self.__dict__.copy()
+        state["memory"] = None
+        state["used"] = set()
+        return state
+
+    def key(self, data, page, options):
+        """Computes the cache key for a page's raw content, its nav entry and
+        the options the per-page filters are run with."""
+        h = hashlib.sha256()
+        h.update(
+            json.dumps(
+                [self.version, page["file"], page["title"], page["level"], options],
+                sort_keys=True,
+            ).encode("utf-8")
+        )
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key, deps=None, images=None):
+        """Returns the cached lines for `key`, or None on a miss. On a hit,
+        appends the entry's dependencies and images (see put()) to the lists
+        `deps` and `images`, if given."""
+        entry = None
+        if self.memory is not None:
+            entry = self.memory.get(key)
+            self.used.add(key)
+
+        if entry is None and self.cache_dir:
+            fname = self.path(key)
+            try:
+                with open(fname, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+
+            # Touch the entry so eviction drops the least recently used ones first
+            try:
+                os.utime(fname)
+            except OSError:
+                pass
+
+            if self.memory is not None:
+                self.memory[key] = entry
+
+        if entry is None:
+            return None
+
+        # Entries written before images were recorded
+        if "images" not in entry:
+            return None
+
+        for dep, stamp in entry["deps"].items():
+            if file_stamp(dep) != stamp:
+                return None
+
+        if deps is not None:
+            deps.extend(entry["deps"])
+        if images is not None:
+            images.extend(entry["images"])
+        return entry["lines"]
+
+    def put(self, key, lines, deps=(), images=()):
+        """Stores `lines` under `key`, together with the current stamps of the
+        files listed in `deps` and the images the lines refer to (which don't
+        invalidate the entry)."""
+        entry = {
+            "deps": {dep: file_stamp(dep) for dep in deps},
+            "images": list(images),
+            "lines": lines,
+        }
+        if self.memory is not None:
+            self.memory[key] = entry
+            self.used.add(key)
+
+        if not self.cache_dir:
+            return
+
+        import tempfile
+
+        fname = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            # Write to a temporary file first so concurrent workers never see
+            # a half-written entry.
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, fname)
+        except OSError:
+            # A cache that cannot be written to is not fatal.
+            pass
+
+    def prune(self):
+        """Drops memory cache entries not used since the last call and evicts
+        the least recently used entries on disk until the cache fits into
+        max_size bytes. Returns the number of evicted disk entries. Only the
+        entry directories are pruned: files next to them (the xref index) are
+        left alone."""
+        if self.memory is not None:
+            for key in set(self.memory) - self.used:
+                del self.memory[key]
+            self.used = set()
+
+        if not self.cache_dir:
+            return 0
+
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.cache_dir):
+            if root == self.cache_dir:
+                continue
+            for name in files:
+                fname = os.path.join(root, name)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fname))
+                total += st.st_size
+
+        evicted = 0
+        entries.sort()
+        for mtime, size, fname in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        return evicted
@@ -20,13 +20,34 @@
 
 import argparse
 import codecs
+import os
 import sys
+import time
 
 import mkdocs_combine
+import mkdocs_combine.batch
+import mkdocs_combine.deps
+import mkdocs_combine.profiler
+import mkdocs_combine.watch
+from mkdocs_combine.cache import package_version, site_cache_dir
 from mkdocs_combine.exceptions import FatalError
-from pkg_resources import get_distribution
 
-__version__ = get_distribution("mkdocs-combine").version
+
+class VersionAction(argparse.Action):
+    """Like argparse's "version" action, but only looks up the version of the
+    installed package if it is actually asked for"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+        super().__init__(
+            option_strings, dest=dest, default=argparse.SUPPRESS, nargs=0, help=help
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        # Like argparse's action, print to stdout (parser.exit() prints to
+        # stderr)
+        sys.stdout.write(f"{parser.prog} {package_version()}\n")
+        sys.stdout.flush()
+        parser.exit()
 
 
 def stdout_file(encoding):
@@ -36,17 +57,34 @@ def stdout_file(encoding):
     if sys.version_info.major == 2:
         return codecs.getwriter(encoding)(sys.stdout)
     elif sys.version_info.major >= 3:
-        return open(sys.stdout.fileno(), mode="w", encoding=encoding, buffering=1)
+        return open(
+            sys.stdout.fileno(),
+            mode="w",
+            encoding=encoding,
+            buffering=1,
+            closefd=False,
+        )
 
 
-def parse_args():
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    # "mkdocscombine serve [options]" starts a server instead
+    serve = argv[:1] == ["serve"]
+    if serve:
+        argv = argv[1:]
+
     args = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) + (" serve" if serve else ""),
         description="mkdocscombine.py "
-        + "- combines an MkDocs source site into a single Markdown document"
+        + "- combines an MkDocs source site into a single Markdown document",
     )
 
     args.add_argument(
-        "-V", "--version", action="version", version=f"%(prog)s {__version__}"
+        "-V",
+        "--version",
+        action=VersionAction,
+        help="show program's version number and exit",
     )
     args.add_argument(
         "-v",
@@ -93,6 +131,46 @@ def parse_args():
         default=None,
         help="write simple HTML to path ('-' for stdout)",
     )
+    args_split = args_files.add_mutually_exclusive_group(required=False)
+    args_split.add_argument(
+        "--split-sections",
+        dest="split_sections",
+        action="store_true",
+        help="split the Markdown into one file per top-level nav section, "
+        "named after the output file (out.md: out-001.md, out-002.md, ...)",
+    )
+    args_split.add_argument(
+        "--split-pages",
+        dest="split_pages",
+        default=None,
+        type=int,
+        help="split the Markdown into files of at most this many pages each",
+    )
+    args_split.add_argument(
+        "--split-size",
+        dest="split_size",
+        default=None,
+        type=int,
+        help="split the Markdown into files of about this many MB each (cut "
+        "at the first page boundary past the size)",
+    )
+    args_files.add_argument(
+        "--batch",
+        dest="batch",
+        default=None,
+        help="combine each site listed in path (one config file per line, "
+        "optionally followed by an output file; default: the config file "
+        "with the extension .md) into its own output; -j sets the number of "
+        "sites combined in parallel",
+    )
+    args_files.add_argument(
+        "--deps",
+        dest="deps",
+        default=None,
+        help="write the files the outputs were made from (config file, pages, "
+        "included files and images) to path after each build, as a Makefile "
+        "rule or, if path ends with .json, as JSON",
+    )
 
     args_struct = args.add_argument_group("structure")
     args_strip_metadata = args_struct.add_mutually_exclusive_group(required=False)
@@ -186,6 +264,7 @@ def parse_args():
         "--grid-width",
         dest="width",
         default=100,
+        type=int,
         help="char width of converted grid tables (default: 100)",
     )
 
@@ -205,6 +284,13 @@ def parse_args():
         action="store_true",
         help="replace MkDocs-style cross-references by just their title (default)",
     )
+    args_filter_xrefs.add_argument(
+        "--resolve-refs",
+        dest="resolve_xrefs",
+        action="store_true",
+        help="turn cross-references to other pages and their headings into links "
+        "within the combined document (others are replaced by their title)",
+    )
     args.set_defaults(filter_xrefs=True)
 
     args_strip_anchors = args_links.add_mutually_exclusive_group(required=False)
@@ -257,35 +343,245 @@ def parse_args():
         help="convert admonitions to HTML already in the Markdown",
     )
 
-    return args.parse_args()
+    args_processing = args.add_argument_group("processing")
+    args_processing.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        default=1,
+        type=int,
+        help="number of parallel jobs for per-page processing (0 for one per CPU, default: 1)",
+    )
+    args_processing.add_argument(
+        "--pool",
+        dest="pool",
+        default="process",
+        choices=["process", "thread"],
+        help="run parallel jobs in worker processes or threads (default: process)",
+    )
 
+    args_processing.add_argument(
+        "--prefetch",
+        dest="prefetch",
+        default=8,
+        type=int,
+        help="number of page files to read ahead while processing pages in a "
+        "single job (0 to disable, default: 8)",
+    )
 
-def main():
-    args = parse_args()
+    args_processing.add_argument(
+        "--mmap-threshold",
+        dest="mmap_threshold",
+        default=8,
+        type=int,
+        help="memory-map page files of at least this many MB and decode them "
+        "lazily (0 to disable, default: 8)",
+    )
 
-    try:
-        mkdocs_combiner = mkdocs_combine.MkDocsCombiner(
-            config_file=args.config_file,
-            exclude=args.exclude,
-            image_ext=args.image_ext,
-            width=args.width,
-            encoding=args.encoding,
-            filter_tables=args.filter_tables,
-            filter_xrefs=args.filter_xrefs,
-            strip_anchors=args.strip_anchors,
-            strip_metadata=args.strip_metadata,
-            convert_math=args.convert_math,
-            add_chapter_heads=args.add_chapter_heads,
-            increase_heads=args.increase_heads,
-            add_page_break=args.add_page_break,
-            verbose=args.verbose,
-            convert_admonition_md=args.convert_admonition_md,
+    args_processing.add_argument(
+        "-w",
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help="keep running and rebuild the outputs when pages or the config file change",
+    )
+    args_processing.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=".mkdocscombine-cache",
+        help="cache per-page results and rendered HTML in this directory, "
+        "relative to the directory of the config file (default: "
+        ".mkdocscombine-cache)",
+    )
+    args_processing.add_argument(
+        "--no-cache",
+        dest="cache_dir",
+        action="store_const",
+        const=None,
+        help="do not cache per-page results",
+    )
+    args_processing.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        default=256,
+        type=int,
+        help="maximum size of the page cache in MB (default: 256)",
+    )
+    args_processing.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        help="print include cache statistics to stderr after each build",
+    )
+    args_processing.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="print the time spent per phase, filter and page to stderr after "
+        "each build",
+    )
+    args_processing.add_argument(
+        "--profile-json",
+        dest="profile_json",
+        default=None,
+        help="write the time spent per phase, filter and page to path as JSON "
+        "after each build",
+    )
+
+    args_server = args.add_argument_group("server (mkdocscombine serve)")
+    args_server.add_argument(
+        "--host",
+        dest="host",
+        default=None,
+        help="answer requests on this address (default: 127.0.0.1)",
+    )
+    args_server.add_argument(
+        "--port",
+        dest="port",
+        default=None,
+        type=int,
+        help="answer requests on this port (default: 8000)",
+    )
+    args_server.add_argument(
+        "--socket",
+        dest="socket",
+        default=None,
+        help="answer requests on this Unix socket instead",
+    )
+    args_server.add_argument(
+        "--allow-config",
+        dest="allowed_configs",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="also answer requests for this config file outside the directory "
+        "of -f (may be given more than once)",
+    )
+    args_server.add_argument(
+        "--max-sites",
+        dest="max_sites",
+        default=None,
+        type=int,
+        help="number of sites to keep loaded (default: 16)",
+    )
+
+    parsed = args.parse_args(argv)
+    parsed.serve = serve
+    parsed.split, parsed.split_limit = None, None
+    if parsed.split_sections:
+        parsed.split = "section"
+    elif parsed.split_pages is not None:
+        parsed.split, parsed.split_limit = "pages", parsed.split_pages
+    elif parsed.split_size is not None:
+        parsed.split, parsed.split_limit = "size", parsed.split_size * 1024 * 1024
+    if parsed.split_limit is not None and parsed.split_limit < 1:
+        args.error("--split-pages and --split-size need a limit of at least 1")
+    if parsed.split and (not parsed.outfile or parsed.outfile == "-" or parsed.batch):
+        args.error(
+            "--split-sections, --split-pages and --split-size need an output "
+            "file (-o) and can't be combined with --batch"
         )
-    except FatalError as e:
-        print(e.message, file=sys.stderr)
-        return e.status
+    if parsed.batch and (
+        parsed.outfile
+        or parsed.outhtml
+        or parsed.watch
+        or parsed.profile
+        or parsed.profile_json
+        or parsed.deps
+    ):
+        args.error(
+            "--batch writes one output per site and can't be combined with -o, "
+            "-H, --watch, --profile, --profile-json or --deps"
+        )
+    if serve and (
+        parsed.outfile
+        or parsed.outhtml
+        or parsed.batch
+        or parsed.split
+        or parsed.deps
+        or parsed.watch
+        or parsed.profile
+        or parsed.profile_json
+    ):
+        args.error(
+            "serve answers requests instead of writing outputs and can't be "
+            "combined with -o, -H, --batch, --split-*, --deps, --watch, "
+            "--profile or --profile-json"
+        )
+    if not serve and (
+        parsed.host
+        or parsed.port
+        or parsed.socket
+        or parsed.allowed_configs
+        or parsed.max_sites is not None
+    ):
+        args.error(
+            "--host, --port, --socket, --allow-config and --max-sites only "
+            "apply to mkdocscombine serve"
+        )
+    if parsed.max_sites is not None and parsed.max_sites < 1:
+        args.error("--max-sites needs at least 1")
+    if parsed.socket and (parsed.host or parsed.port):
+        args.error("--socket can't be combined with --host or --port")
+    if parsed.deps and not (
+        parsed.outfile not in (None, "-") or parsed.outhtml not in (None, "-")
+    ):
+        args.error("--deps needs an output file (-o or -H)")
+    return parsed
+
+
+def write_outputs(mkdocs_combiner, args, profiler=None):
+    """Combines the site and writes the Markdown and/or HTML to the requested
+    outputs"""
+    targets = []
+    if args.split:
+        targets.extend(write_parts(mkdocs_combiner, args))
+    else:
+        write_markdown(mkdocs_combiner, args)
+        if args.outfile and args.outfile != "-":
+            targets.append(args.outfile)
+
+    html_file = None
+    if args.outhtml == "-":
+        html_file = stdout_file(args.encoding)
+    elif args.outhtml:
+        try:
+            html_file = codecs.open(args.outhtml, "w", encoding=args.encoding)
+        except OSError as e:
+            print(
+                f"Couldn't open {args.outhtml} for writing: {e.strerror}",
+                file=sys.stderr,
+            )
+    if html_file:
+        html = mkdocs_combiner.to_html()
+        start = time.perf_counter()
+        html_file.write(html)
+        html_file.close()
+        mkdocs_combiner.emit("write", args.outhtml, time.perf_counter() - start)
+        if args.outhtml != "-":
+            targets.append(args.outhtml)
+
+    if args.deps and targets:
+        try:
+            mkdocs_combine.deps.write_manifest(
+                args.deps, targets, mkdocs_combiner.dependencies(), args.encoding
+            )
+        except FatalError as e:
+            print(e.message, file=sys.stderr)
+
+    if args.stats:
+        print_stats(mkdocs_combiner.include_stats)
+
+    if profiler:
+        print_profile(profiler, args)
 
-    mkdocs_combiner.combine()
+
+def write_markdown(mkdocs_combiner, args):
+    """Combines the site and writes the Markdown to its output, if any"""
+    # The HTML is rendered from the complete document; only stream the
+    # Markdown straight to its output if no HTML is requested.
+    if args.outhtml or not args.outfile:
+        mkdocs_combiner.combine()
 
     combined_md_file = None
     if args.outfile == "-":
@@ -299,20 +595,240 @@ def main():
                 file=sys.stderr,
             )
     if combined_md_file:
-        combined_md_file.write("\n".join(mkdocs_combiner.combined_md_lines))
-        combined_md_file.close()
+        try:
+            if args.outhtml:
+                start = time.perf_counter()
+                combined_md_file.write("\n".join(mkdocs_combiner.combined_md_lines))
+                mkdocs_combiner.emit(
+                    "write",
+                    args.outfile,
+                    time.perf_counter() - start,
+                    len(mkdocs_combiner.combined_md_lines),
+                )
+            else:
+                mkdocs_combiner.combine_to(combined_md_file)
+        finally:
+            combined_md_file.close()
 
-    html_file = None
-    if args.outhtml == "-":
-        html_file = stdout_file(args.encoding)
-    elif args.outhtml:
+
+def write_parts(mkdocs_combiner, args):
+    """Combines the site and writes the Markdown split into parts. Returns
+    the paths of the parts."""
+    try:
+        if args.outhtml:
+            # Keep the whole document for the HTML
+            parts = mkdocs_combiner.combine_parts(args.split, args.split_limit)
+            return mkdocs_combiner.write_parts(args.outfile, parts)
+        return mkdocs_combiner.combine_to_parts(
+            args.outfile, args.split, args.split_limit
+        )
+    except FatalError as e:
+        print(e.message, file=sys.stderr)
+        return []
+
+
+def print_stats(include_stats):
+    """Reports include cache counters on stderr"""
+    hits = include_stats["hits"]
+    misses = include_stats["misses"]
+    total = hits + misses
+    rate = f" ({100.0 * hits / total:.1f}% hits)" if total else ""
+    print(f"Includes: {hits} hits, {misses} misses{rate}", file=sys.stderr)
+
+
+def print_profile(profiler, args):
+    """Reports the timings of the last build on stderr and/or as JSON, then
+    starts over for the next build"""
+    if args.profile:
+        for line in profiler.summary():
+            print(line, file=sys.stderr)
+    if args.profile_json:
         try:
-            html_file = codecs.open(args.outhtml, "w", encoding=args.encoding)
+            profiler.write_json(args.profile_json)
         except OSError as e:
             print(
-                f"Couldn't open {args.htmlfile} for writing: {e.strerror}",
+                f"Couldn't open {args.profile_json} for writing: {e.strerror}",
                 file=sys.stderr,
             )
-    if html_file:
-        html_file.write(mkdocs_combiner.to_html())
-        html_file.close()
+    profiler.reset()
+
+
+def watch(mkdocs_combiner, args, profiler=None):
+    """Rebuilds the outputs whenever a page or the config file changes"""
+    write_outputs(mkdocs_combiner, args, profiler)
+
+    # Don't trigger rebuilds on our own output files
+    outputs = [
+        path
+        for path in (args.outfile, args.outhtml, args.profile_json, args.deps)
+        if path and path != "-"
+    ]
+    watcher = mkdocs_combine.watch.Watcher(
+        [mkdocs_combiner.config["docs_dir"], args.config_file], ignore=outputs
+    )
+    config_file = os.path.abspath(args.config_file)
+    print(
+        f"Watching {', '.join(watcher.paths)} for changes (Ctrl+C to stop)",
+        file=sys.stderr,
+    )
+
+    try:
+        while True:
+            changed = watcher.wait()
+            try:
+                if config_file in changed:
+                    mkdocs_combiner.load_config()
+                    watcher.watch([mkdocs_combiner.config["docs_dir"], config_file])
+                write_outputs(mkdocs_combiner, args, profiler)
+            except FatalError as e:
+                print(e.message, file=sys.stderr)
+                continue
+            print(f"Rebuilt after changes to {len(changed)} file(s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        return 0
+
+
+def combiner_options(args):
+    """Returns the MkDocsCombiner options the command line sets for every
+    site"""
+    return dict(
+        exclude=args.exclude,
+        image_ext=args.image_ext,
+        width=args.width,
+        encoding=args.encoding,
+        filter_tables=args.filter_tables,
+        filter_xrefs=args.filter_xrefs,
+        resolve_xrefs=args.resolve_xrefs,
+        strip_anchors=args.strip_anchors,
+        strip_metadata=args.strip_metadata,
+        convert_math=args.convert_math,
+        add_chapter_heads=args.add_chapter_heads,
+        increase_heads=args.increase_heads,
+        add_page_break=args.add_page_break,
+        verbose=args.verbose,
+        convert_admonition_md=args.convert_admonition_md,
+        prefetch=args.prefetch,
+        mmap_threshold=args.mmap_threshold * 1024 * 1024,
+        cache_dir=args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024,
+    )
+
+
+def batch(args):
+    """Combines all the sites listed in the --batch file"""
+    try:
+        sites = mkdocs_combine.batch.read_site_list(args.batch, args.encoding)
+    except FatalError as e:
+        print(e.message, file=sys.stderr)
+        return e.status
+
+    def on_site(result):
+        if result["error"]:
+            print(result["error"], file=sys.stderr)
+        elif args.verbose:
+            print(
+                f"[mkdocscombine] Combined {result['config_file']} into "
+                f"{result['outfile']} in {result['seconds']:.3f}s"
+            )
+
+    start = time.perf_counter()
+    results = mkdocs_combine.batch.combine_many(
+        sites,
+        jobs=args.jobs,
+        pool=args.pool,
+        on_site=on_site,
+        **combiner_options(args),
+    )
+
+    failed = [result for result in results if result["error"]]
+    print(
+        f"Combined {len(results) - len(failed)} of {len(results)} sites in "
+        f"{time.perf_counter() - start:.2f}s",
+        file=sys.stderr,
+    )
+    if args.stats:
+        print_stats(mkdocs_combine.batch.include_totals(results))
+    if failed:
+        return max(result["status"] for result in failed)
+    return 0
+
+
+def serve(args):
+    """Answers combine and HTML requests until interrupted, keeping the sites
+    it combined loaded (mkdocscombine serve)"""
+    import mkdocs_combine.server
+
+    mkdocs_combine.batch.warm_up()
+    combine_server = mkdocs_combine.server.CombineServer(
+        max_sites=16 if args.max_sites is None else args.max_sites,
+        jobs=args.jobs,
+        pool=args.pool,
+        **combiner_options(args),
+    )
+    host = args.host or "127.0.0.1"
+    port = 8000 if args.port is None else args.port
+    address = args.socket or f"http://{host}:{port}"
+    try:
+        httpd = mkdocs_combine.server.make_server(
+            combine_server,
+            host=host,
+            port=port,
+            socket_path=args.socket,
+            config_file=args.config_file,
+            allowed_configs=args.allowed_configs,
+            verbose=args.verbose,
+        )
+    except OSError as e:
+        print(f"Couldn't listen on {address}: {e.strerror}", file=sys.stderr)
+        return 1
+
+    # Have the default site ready for the first request
+    if os.path.exists(args.config_file):
+        try:
+            combine_server.combine(args.config_file)
+        except FatalError as e:
+            print(e.message, file=sys.stderr)
+
+    print(f"Serving on {address} (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        httpd.server_close()
+
+
+def main():
+    args = parse_args()
+
+    if args.serve:
+        return serve(args)
+
+    if args.batch:
+        return batch(args)
+
+    profiler = None
+    hooks = []
+    if args.profile or args.profile_json:
+        profiler = mkdocs_combine.profiler.Profiler()
+        hooks.append(profiler)
+
+    options = combiner_options(args)
+    options["cache_dir"] = site_cache_dir(args.cache_dir, args.config_file)
+    try:
+        mkdocs_combiner = mkdocs_combine.MkDocsCombiner(
+            config_file=args.config_file,
+            jobs=args.jobs,
+            pool=args.pool,
+            memory_cache=args.watch,
+            hooks=hooks,
+            **options,
+        )
+    except FatalError as e:
+        print(e.message, file=sys.stderr)
+        return e.status
+
+    if args.watch:
+        return watch(mkdocs_combiner, args, profiler)
+
+    write_outputs(mkdocs_combiner, args, profiler)
@@ -0,0 +1,103 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# deps.py - writes the files a combined document was made from as a manifest
+
+import codecs
+import json
+import os
+
+from mkdocs_combine.exceptions import FatalError
+
+
+def display_path(path):
+    """Returns `path` relative to the current directory, or absolute if it
+    is on another drive"""
+    try:
+        return os.path.relpath(path)
+    except ValueError:
+        return os.path.abspath(path)
+
+
+def make_escape(path):
+    """Escapes a path for a Makefile rule"""
+    path = path.replace(os.path.sep, "/")
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def inputs(dependencies):
+    """Returns all the input files listed in `dependencies` (see
+    MkDocsCombiner.dependencies()) that exist, without duplicates"""
+    paths = [dependencies["config"]]
+    for kind in ("pages", "includes", "images"):
+        paths.extend(path for path in dependencies[kind] if os.path.exists(path))
+    return list(dict.fromkeys(display_path(path) for path in paths))
+
+
+def missing(dependencies):
+    """Returns the included files and images listed in `dependencies` that
+    don't exist, without duplicates"""
+    paths = []
+    for kind in ("includes", "images"):
+        paths.extend(path for path in dependencies[kind] if not os.path.exists(path))
+    return list(dict.fromkeys(display_path(path) for path in paths))
+
+
+def format_make(targets, dependencies):
+    """Returns a Makefile rule making `targets` depend on all inputs, followed
+    by an empty rule for each input (like gcc -MP), so that make doesn't fail
+    once an input is deleted. Inputs that don't exist are left out (an empty
+    rule would have make rebuild the targets every time) and listed in a
+    comment."""
+    targets = " ".join(make_escape(display_path(target)) for target in targets)
+    paths = [make_escape(path) for path in inputs(dependencies)]
+    lines = [f"{targets}: \\"]
+    lines.extend(f"  {path} \\" for path in paths[:-1])
+    lines.append(f"  {paths[-1]}")
+    for path in paths:
+        lines.append("")
+        lines.append(f"{path}:")
+    absent = missing(dependencies)
+    if absent:
+        lines.append("")
+        lines.append("# Missing (included or referenced, but not found):")
+        lines.extend(f"#   {path}" for path in absent)
+    return "\n".join(lines) + "\n"
+
+
+def format_json(targets, dependencies):
+    manifest = {"targets": [display_path(target) for target in targets]}
+    manifest["config"] = display_path(dependencies["config"])
+    for kind in ("pages", "includes", "images"):
+        manifest[kind] = [
+            display_path(path) for path in dependencies[kind] if os.path.exists(path)
+        ]
+    manifest["missing"] = missing(dependencies)
+    return json.dumps(manifest, indent=2) + "\n"
+
+
+def write_manifest(path, targets, dependencies, encoding="utf-8"):
+    """Writes the inputs of `targets` to `path`: as JSON if `path` ends with
+    .json, as a Makefile rule (for make's include) otherwise"""
+    if path.endswith(".json"):
+        text = format_json(targets, dependencies)
+    else:
+        text = format_make(targets, dependencies)
+    try:
+        f = codecs.open(path, "w", encoding=encoding)
+    except OSError as e:
+        raise FatalError(f"Couldn't open {path} for writing: {e.strerror}", 1)
+    with f:
+        f.write(text)
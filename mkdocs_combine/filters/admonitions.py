@@ -16,9 +16,10 @@
 #
 # mdtableconv.py - converts pipe tables to Pandoc's grid tables
 
-import markdown.blockparser
+import xml.etree.ElementTree as etree
+
 import markdown.extensions.admonition as adm
-from markdown.util import etree
+from mkdocs_combine.filters import blocks
 
 
 class AdmonitionFilter(adm.AdmonitionProcessor):
@@ -28,40 +29,31 @@ class AdmonitionFilter(adm.AdmonitionProcessor):
 
     def blocks(self, lines):
         """Groups lines into markdown blocks"""
-        state = markdown.blockparser.State()
-        blocks = []
-
-        # We use three states: start, ``` and '\n'
-        state.set("start")
-
-        # index of current block
-        currblock = 0
-
-        for line in lines:
-            line += "\n"
-            if state.isstate("start"):
-                if line[:3] == "```":
-                    state.set("```")
-                else:
-                    state.set("\n")
-                blocks.append("")
-                currblock = len(blocks) - 1
-            else:
-                marker = line[:3]  # Will capture either '\n' or '```'
-                if state.isstate(marker):
-                    state.reset()
-            blocks[currblock] += line
-
-        return blocks
+        return [blocks.join(lines, start, end) for start, end in blocks.spans(lines)]
+
+    def convert_span(self, lines, start, end):
+        """Converts the block lines[start:end] if it is an admonition. Blocks
+        without a !!! marker cannot be admonitions and are returned as is
+        (followed by an empty line, like convert_admonition() does)."""
+        for i in range(start, end):
+            if "!!!" in lines[i]:
+                return self.convert_admonition(blocks.join(lines, start, end))
+
+        ret = lines[start:end]
+        ret.append("")
+        return ret
+
+    def stream(self, lines):
+        """Filter method for iterables: converts blocks as soon as they are
+        complete and yields the resulting lines"""
+        for block in blocks.iter_blocks(lines):
+            yield from self.convert_span(block, 0, len(block))
 
     def run(self, lines):
         """Filter method: Passes all blocks through convert_admonition() and returns a list of lines."""
         ret = []
-
-        blocks = self.blocks(lines)
-        for block in blocks:
-            ret.extend(self.convert_admonition(block))
-
+        for start, end in blocks.spans(lines):
+            ret.extend(self.convert_span(lines, start, end))
         return ret
 
     def convert_admonition(self, block):
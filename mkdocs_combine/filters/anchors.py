@@ -13,16 +13,21 @@
 # limitations under the License.
 #
 
-import re
+from mkdocs_combine.filters import patterns
 
 
 class AnchorFilter:
     """Strips out HTML anchor tags"""
 
-    def run(self, lines):
-        """Filter method"""
-        ret = []
+    def filter_line(self, line):
+        """Filters a single line"""
+        return patterns.ANCHOR.sub("", line)
+
+    def stream(self, lines):
+        """Filter method for iterables: yields filtered lines one by one"""
         for line in lines:
-            ret.append(re.sub(r"<a.*?</a>", "", line))
+            yield self.filter_line(line)
 
-        return ret
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
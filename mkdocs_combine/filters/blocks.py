@@ -0,0 +1,83 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# blocks.py - groups lines into Markdown blocks for the block filters
+
+
+class BlockSegmenter:
+    """Finds the boundaries of Markdown blocks, one line at a time.
+
+    A block starting with a ``` line extends up to and including the next
+    ``` line, any other block up to and including the next empty line.
+    """
+
+    FENCE = "```"
+    PARAGRAPH = ""
+
+    def __init__(self):
+        self.state = None
+
+    def feed(self, line):
+        """Consumes the next line. Returns True if it ends the current block."""
+        if self.state is None:
+            if line.startswith(self.FENCE):
+                self.state = self.FENCE
+            else:
+                self.state = self.PARAGRAPH
+            return False
+
+        if self.state is self.FENCE:
+            done = line.startswith(self.FENCE)
+        else:
+            done = line == ""
+        if done:
+            self.state = None
+        return done
+
+
+def spans(lines):
+    """Yields (start, end) index pairs for the blocks in the list `lines`"""
+    segmenter = BlockSegmenter()
+    start = 0
+    for i, line in enumerate(lines):
+        if segmenter.feed(line):
+            yield start, i + 1
+            start = i + 1
+
+    if start < len(lines):
+        yield start, len(lines)
+
+
+def iter_blocks(lines):
+    """Groups the lines of any iterable into blocks, yielding each block as a
+    list of lines as soon as it is complete"""
+    segmenter = BlockSegmenter()
+    block = []
+    for line in lines:
+        block.append(line)
+        if segmenter.feed(line):
+            yield block
+            block = []
+
+    if block:
+        yield block
+
+
+def join(lines, start=0, end=None):
+    """Returns the lines of a block as one string, the way Python-Markdown's
+    block processors expect it"""
+    if end is None:
+        end = len(lines)
+    return "\n".join(lines[start:end]) + "\n"
@@ -0,0 +1,114 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# chain.py - runs a sequence of filters over a stream of lines
+
+import collections
+import time
+
+
+class FilterChain:
+    """Runs a sequence of filters over a stream of lines in a single pass.
+
+    Consecutive line filters (filters with a filter_line() method) are fused
+    into one stage that applies all of them to each line in turn. Block
+    filters (everything else, used through their stream() method) form
+    stages of their own that buffer one block at a time. The order of the
+    filters is preserved.
+    """
+
+    def __init__(self, filters=(), timed=False):
+        self.stages = []  # list of (fused, [filters])
+        self.timed = timed
+        self.timings = collections.OrderedDict()
+        self.line_counts = collections.OrderedDict()
+        for f in filters:
+            self.add(f)
+
+    def add(self, f):
+        """Appends a filter to the chain"""
+        fused = hasattr(f, "filter_line")
+        if fused and self.stages and self.stages[-1][0]:
+            self.stages[-1][1].append(f)
+        else:
+            self.stages.append((fused, [f]))
+
+    def stage_name(self, filters):
+        return "+".join(type(f).__name__ for f in filters)
+
+    def stream(self, lines, source="input"):
+        """Filter method for iterables: yields the filtered lines. With `timed`
+        set, the time spent in each stage (and in producing the input, under
+        the name `source`) is recorded in `timings` once the stream is
+        exhausted, and the number of lines each stage produced in
+        `line_counts`."""
+        names = [source]
+        elapsed = [0.0]
+        counts = [0]
+        if self.timed:
+            lines = self.time(lines, elapsed, counts, 0)
+
+        for fused, filters in self.stages:
+            if fused and len(filters) == 1:
+                lines = map(filters[0].filter_line, lines)
+            elif fused:
+                lines = self.fuse([f.filter_line for f in filters], lines)
+            else:
+                lines = filters[0].stream(lines)
+
+            if self.timed:
+                names.append(self.stage_name(filters))
+                elapsed.append(0.0)
+                counts.append(0)
+                lines = self.time(lines, elapsed, counts, len(elapsed) - 1)
+
+        yield from lines
+
+        if not self.timed:
+            return
+
+        # Every stage pulls its input from the previous one, so the time
+        # measured for a stage includes the time of all stages before it.
+        self.timings = collections.OrderedDict()
+        self.line_counts = collections.OrderedDict()
+        for i, name in enumerate(names):
+            self.timings[name] = elapsed[i] - (elapsed[i - 1] if i else 0.0)
+            self.line_counts[name] = counts[i]
+
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
+
+    def fuse(self, funcs, lines):
+        for line in lines:
+            for func in funcs:
+                line = func(line)
+            yield line
+
+    def time(self, lines, elapsed, counts, index):
+        """Yields from `lines`, adding the time spent waiting for each line to
+        elapsed[index] and counting the lines in counts[index]"""
+        lines = iter(lines)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                line = next(lines)
+            except StopIteration:
+                elapsed[index] += clock() - start
+                return
+            elapsed[index] += clock() - start
+            counts[index] += 1
+            yield line
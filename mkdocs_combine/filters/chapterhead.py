@@ -23,6 +23,12 @@ class ChapterheadFilter:
         if self.title is None:
             raise ValueError("Mandatory keyword argument `title` missing.")
 
+    def stream(self, lines):
+        """Filter method for iterables: yields the filtered lines"""
+        yield ("#" * self.headlevel) + " " + self.title
+        yield ""
+        yield from lines
+
     def run(self, lines):
         """Filter method"""
 
@@ -21,14 +21,17 @@ class ExcludeFilter:
     a macros include pulled in by every chapter)"""
 
     def __init__(self, **kwargs):
-        self.exclude = kwargs.get("exclude", [])
+        self.exclude = kwargs.get("exclude", None) or []
+        # Compiled once per filter (each name is itself a regular expression)
+        self.patterns = [re.compile(r"\{!%s!\}" % name) for name in self.exclude]
 
-    def run(self, lines):
-        """Filter method"""
-        ret = []
+    def stream(self, lines):
+        """Filter method for iterables: yields the filtered lines"""
         for line in lines:
-            for exclude in self.exclude:
-                line = re.sub(r"\{!%s!\}" % exclude, "", line)
-            ret.append(line)
+            for pattern in self.patterns:
+                line = pattern.sub("", line)
+            yield line
 
-        return ret
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import re
+from mkdocs_combine.filters import patterns
 
 # TODO: Implement handling for Setext style headers.
 
@@ -30,17 +30,19 @@ class HeadlevelFilter:
                 max_offset = page["level"]
 
         self.offset = max_offset
+        self.prefix = "#" * self.offset
 
-    def run(self, lines):
+    def stream(self, lines):
+        """Filter method for iterables: yields the filtered lines"""
         not_in_code_block = True
-        """Filter method"""
-        ret = []
         for line in lines:
             if "```" in line:
                 not_in_code_block = not not_in_code_block
             if not_in_code_block is True:
-                line = re.sub(r"^#", "#" * self.offset, line)
-                line = re.sub(r"^#######+", "######", line)
-            ret.append(line)
+                line = patterns.HEADING.sub(self.prefix, line)
+                line = patterns.HEADING_OVERFLOW.sub("######", line)
+            yield line
 
-        return ret
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
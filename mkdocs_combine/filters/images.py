@@ -14,77 +14,87 @@
 #
 
 import os
-import re
+
+from mkdocs_combine.filters import patterns
+
+
+def resolve(img_name, base, image_ext):
+    """Returns the adjusted target of an image. `base` holds the path
+    components to prepend (if any)."""
+    if image_ext:
+        img_name = patterns.EXTENSION.sub("." + image_ext, img_name)
+
+    if base:
+        img_name = os.path.join(*base, img_name)
+
+    # handle Windows '\', although this adds a small amount of unnecessary work on Unix systems
+    return img_name.replace(os.path.sep, "/")
 
 
 class ImageFilter:
     """Filter for adjusting image targets (absolute file names, optionally
-    different extensions"""
+    different extensions). Appends the original targets of all local images
+    to the list `images`, if given. Adjusted targets are memoized in the dict
+    `resolved`, which the filters of all pages of a build share, so pages in
+    the same directory resolve each target once."""
 
     def __init__(self, **kwargs):
         self.filename = kwargs.get("filename", None)
         self.image_path = kwargs.get("image_path", None)
         self.adjust_path = kwargs.get("adjust_path", True)
         self.image_ext = kwargs.get("image_ext", None)
+        self.images = kwargs.get("images", None)
+        self.resolved = kwargs.get("resolved", None)
+        if self.resolved is None:
+            self.resolved = {}
+
+        self.base = ()
+        if self.adjust_path and (self.image_path or self.filename):
+            # explicitely specified image path takes precedence over
+            # path relative to chapter
+            if self.image_path and self.filename:
+                self.base = (
+                    os.path.abspath(self.image_path),
+                    os.path.dirname(self.filename),
+                )
 
-    def run(self, lines):
-        """Filter method"""
-        # Nothing to do in this case
-        if (not self.adjust_path) and (not self.image_ext):
-            return lines
+            # generate image path relative to file name
+            if self.filename and (not self.image_path):
+                self.base = (os.path.abspath(os.path.dirname(self.filename)),)
 
-        ret = []
+    def replace(self, match):
+        """Substitution callback: returns an image with adjusted target"""
+        img_name = match.group(2)
 
-        for line in lines:
-            processed = {}
-            while True:
-                alt = ""
-                img_name = ""
-
-                match = re.search(r"!\[(.*?)\]\((.*?)\)", line)
-
-                # Make sure there is in fact an image file name
-                if match:
-                    # Skip images we already processed
-                    if match.group(0) in processed:
-                        break
-                    # Skip URLs
-                    if re.match(r"\w+://", match.group(2)):
-                        break
-                    alt = match.group(1)
-                    img_name = match.group(2)
-                else:
-                    break
-
-                if self.image_ext:
-                    img_name = re.sub(r"\.\w+$", "." + self.image_ext, img_name)
-
-                if self.adjust_path and (self.image_path or self.filename):
-                    # explicitely specified image path takes precedence over
-                    # path relative to chapter
-                    if self.image_path and self.filename:
-                        img_name = os.path.join(
-                            os.path.abspath(self.image_path),
-                            os.path.dirname(self.filename),
-                            img_name,
-                        )
-
-                    # generate image path relative to file name
-                    if self.filename and (not self.image_path):
-                        img_name = os.path.join(
-                            os.path.abspath(os.path.dirname(self.filename)), img_name
-                        )
-
-                # handle Windows '\', although this adds a small amount of unnecessary work on Unix systems
-                img_name = img_name.replace(os.path.sep, "/")
-
-                line = re.sub(
-                    r"!\[(.*?)\]\((.*?)\)", f"![{alt}]({img_name})", line
-                )
+        # Skip URLs
+        if patterns.URL.match(img_name):
+            return match.group(0)
+
+        if self.images is not None:
+            self.images.append(img_name)
+
+        key = (img_name, self.base, self.image_ext)
+        target = self.resolved.get(key)
+        if target is None:
+            target = self.resolved[key] = resolve(*key)
+        return f"![{match.group(1)}]({target})"
+
+    def stream(self, lines):
+        """Filter method for iterables: yields the filtered lines"""
+        if (not self.adjust_path) and (not self.image_ext) and self.images is None:
+            yield from lines
+            return
 
-                # Mark this image as processed
-                processed[match.group(0)] = True
+        for line in lines:
+            yield patterns.IMAGE.sub(self.replace, line) if "![" in line else line
 
-            ret.append(line)
+    def run(self, lines):
+        """Filter method"""
+        # Nothing to do in this case
+        if (not self.adjust_path) and (not self.image_ext) and self.images is None:
+            return lines
 
-        return ret
+        return [
+            patterns.IMAGE.sub(self.replace, line) if "![" in line else line
+            for line in lines
+        ]
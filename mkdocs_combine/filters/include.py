@@ -12,14 +12,265 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-"""Wrapper for using markdown.markdown_include as simple preprocessor (just
-pulls in includes without running the HTML generator)"""
+"""Expands markdown_include's include statements ({!file!}) in the Markdown
+source, without running the HTML generator. Reimplements markdown_include's
+preprocessor (it is not needed to run), reading every included file once."""
 
-import markdown_include.include as incl
+import codecs
+import collections
+import copy
+import os
+import sys
 
+from mkdocs_combine.cache import file_stamp
+from mkdocs_combine.exceptions import FatalError
+from mkdocs_combine.filters import patterns
+
+# markdown_include 0.6 added {!file!lines=...} (a pattern with 4 groups
+# instead of 1) and changed how include statements are expanded. Sites are
+# built by MkDocs with the installed version, so statements are read like it
+# reads them; like current versions if it isn't installed.
+try:
+    import markdown_include.include
+except ImportError:
+    LEGACY = False
+else:
+    LEGACY = markdown_include.include.INC_SYNTAX.groups == 1
+
+
+class IncludeFilter:
+    """Expands include statements the way markdown_include does, but reads
+    and expands each included file only once: expanded files are memoized
+    together with the stamps (mtime and size) of the file and everything it
+    includes, and reused as long as none of these changed. Include cycles and
+    includes nested deeper than `max_depth` are fatal errors.
+
+    Statements are read and expanded like the installed markdown_include
+    does it: as before version 0.6 if `legacy` is set (the default for
+    markdown_include < 0.6), with {!file!lines=...} and the expansion rules
+    of 0.6 and later otherwise."""
 
-### This class is merely a wrapper for providing markdown_include.include
-class IncludeFilter(incl.IncludePreprocessor):
     def __init__(self, **kwargs):
         self.base_path = kwargs.get("base_path", ".")
         self.encoding = kwargs.get("encoding", "utf-8")
+        self.max_depth = kwargs.get("max_depth", 32)
+        self.legacy = kwargs.get("legacy", LEGACY)
+        self.pattern = patterns.INCLUDE_LEGACY if self.legacy else patterns.INCLUDE
+        self.cache = {}  # path -> (stamps of path and its includes, lines, keeps_tail)
+        self.stats = kwargs.get("stats", None)  # "hits", "misses"
+        if self.stats is None:
+            self.stats = collections.Counter()
+        self.deps = None
+
+    def collecting(self, deps):
+        """Returns a filter sharing this one's cache and counters that appends
+        the paths of all included files to the list `deps`"""
+        f = copy.copy(self)
+        f.deps = deps
+        return f
+
+    def path(self, name):
+        filename = os.path.expanduser(name)
+        if not os.path.isabs(filename):
+            filename = os.path.normpath(os.path.join(self.base_path, filename))
+        return filename
+
+    def load(self, filename, stack):
+        """Returns (stamps, expanded lines, keeps_tail) for an included file, or
+        None if it cannot be read. See expand_line() for keeps_tail."""
+        if filename in stack:
+            raise FatalError(
+                f"Include cycle: {' -> '.join(stack + (filename,))}", 1
+            )
+        if len(stack) >= self.max_depth:
+            raise FatalError(
+                f"Includes nested deeper than {self.max_depth} levels: "
+                f"{' -> '.join(stack + (filename,))}",
+                1,
+            )
+
+        entry = self.cache.get(filename)
+        if entry is not None and all(
+            file_stamp(dep) == stamp for dep, stamp in entry[0].items()
+        ):
+            self.stats["hits"] += 1
+            return entry
+        self.stats["misses"] += 1
+
+        stamps = {filename: file_stamp(filename)}
+        try:
+            with codecs.open(filename, "r", self.encoding) as r:
+                text = r.readlines()
+        except (OSError, UnicodeError) as e:
+            print(
+                f"Warning: could not find file {filename}. Ignoring include "
+                f"statement. Error: {e}",
+                file=sys.stderr,
+            )
+            return None
+
+        stack = stack + (filename,)
+        if self.legacy:
+            # Like markdown_include, drop the last character of every line
+            # (the line break).
+            text = [line[0:-1] for line in text]
+            entry = (stamps,) + self.expand(text, stamps, stack)
+        else:
+            try:
+                entry = (stamps, self.expand_lines(text, stamps, stack), True)
+            except (IndexError, ValueError) as e:
+                # markdown_include treats a file whose own include statements
+                # ask for lines that aren't there like a missing file
+                print(
+                    f"Warning: could not find file {filename}. Ignoring include "
+                    f"statement. Error: {e}",
+                    file=sys.stderr,
+                )
+                return None
+        self.cache[filename] = entry
+        return entry
+
+    def include(self, name, stamps, stack):
+        """Returns the entry of the file an include statement names (see
+        load()), or None if it cannot be read. Adds the stamps of the file and
+        everything it includes to the dict `stamps`, if given; that of a file
+        that cannot be read too, so the result changes once it can be."""
+        filename = self.path(name)
+        entry = self.load(filename, stack)
+        if stamps is not None:
+            if entry is None:
+                stamps[filename] = file_stamp(filename)
+            else:
+                stamps.update(entry[0])
+        return entry
+
+    def expand_line(self, line, stamps=None, stack=()):
+        """Returns the lines a single line expands to the way markdown_include
+        < 0.6 expands it, and whether text appended to the line before
+        expansion would still end up at the end of these lines (keeps_tail).
+        The stamps of all included files are added to the dict `stamps`, if
+        given."""
+        m = self.pattern.search(line) if "{!" in line else None
+        if m is None:
+            return [line], True
+
+        entry = self.include(m.group(1), stamps, stack)
+        if entry is None:
+            return [self.pattern.sub("", line)], True
+
+        # As in markdown_include, the included text goes between the text
+        # before the statement and the text up to the next statement;
+        # anything after that is lost. The latter also applies to the text
+        # after the statement if the last line of the included file holds
+        # more than one statement itself.
+        line_split = self.pattern.split(line, maxsplit=0)
+        text = list(entry[1]) or [""]
+        text[0] = line_split[0] + text[0]
+        if entry[2]:
+            text[-1] = text[-1] + line_split[2]
+        return text, entry[2] and len(line_split) == 3
+
+    def expand(self, lines, stamps=None, stack=()):
+        """Returns `lines` with all include statements replaced by the
+        expanded contents of the files they name (markdown_include < 0.6), and
+        keeps_tail for the last line (see expand_line())"""
+        expanded = []
+        keeps_tail = True
+        for line in lines:
+            text, keeps_tail = self.expand_line(line, stamps, stack)
+            expanded.extend(text)
+
+        return expanded, keeps_tail
+
+    def expand_lines(self, lines, stamps=None, stack=()):
+        """Returns `lines` with all include statements expanded the way
+        markdown_include 0.6 and later expands them: the included text, cut
+        to the lines asked for and stripped, replaces the statement, and the
+        resulting lines are scanned again (so a line that expands to nothing
+        hides the line after it, as in markdown_include)"""
+        lines = list(lines)
+        pattern = self.pattern
+        for loc, line in enumerate(lines):
+            m = pattern.search(line) if "{!" in line else None
+            while m:
+                entry = self.include(m.group(1), stamps, stack)
+                if entry is None:
+                    lines[loc] = pattern.sub("", line)
+                    break
+
+                text = entry[1]
+                if m.group(2) is not None:
+                    text = self.select_lines(text, m.group(2), self.path(m.group(1)))
+                text = "\r\n".join(part.rstrip("\r\n") for part in text).strip()
+                line = line[: m.start()] + text + line[m.end() :]
+                del lines[loc]
+                lines[loc:loc] = line.splitlines()
+                m = pattern.search(line)
+        return lines
+
+    @staticmethod
+    def select_lines(text, spec, filename):
+        """Returns the lines of `text` a lines=`spec` option asks for (1-based
+        lines and ranges), as markdown_include picks them. Raises ValueError
+        for malformed ranges and IndexError for lines of an empty file."""
+        selected = []
+        for block in spec.split():
+            if "-" in block:
+                start, end = block.split("-")
+                start, end = int(start), int(end)
+            else:
+                start = end = None
+                line = int(block)
+
+            if start is None:
+                if line > len(text):
+                    print(
+                        f"Warning: line: {line} is larger than file: {filename} "
+                        f"using end: {len(text)}",
+                        file=sys.stderr,
+                    )
+                    line = len(text)
+                selected.append(text[line - 1])
+                continue
+
+            if end > len(text):
+                print(
+                    f"Warning: line range: {block} ending in line: {end} is "
+                    f"larger than file: {filename} using end: {len(text)}",
+                    file=sys.stderr,
+                )
+                end = len(text)
+            if start > end:
+                print(
+                    f"Warning: in line range: {block} the start line: {start} "
+                    f"is not smaller than the end line: {end} using start: "
+                    f"{max(end - 1, 1)}",
+                    file=sys.stderr,
+                )
+                start = max(end - 1, 1)
+            selected.extend(text[start - 1 : end])
+        return selected
+
+    def stream(self, lines, deps=None):
+        """Filter method for iterables: yields the filtered lines. Appends the
+        paths of all included files to `deps` (or the list passed to
+        collecting()), if given, once `lines` are exhausted."""
+        if deps is None:
+            deps = self.deps
+        stamps = {}
+        if self.legacy:
+            for line in lines:
+                yield from self.expand_line(line, stamps)[0]
+        else:
+            # Statements may affect the line after them, see expand_lines()
+            try:
+                yield from self.expand_lines(lines, stamps)
+            except (IndexError, ValueError) as e:
+                raise FatalError(f"Invalid lines option in include statement: {e}", 1)
+        if deps is not None:
+            deps.extend(stamps)
+
+    def run(self, lines, deps=None):
+        """Filter method. Appends the paths of all included files to `deps`,
+        if given."""
+        return list(self.stream(lines, deps))
@@ -14,16 +14,21 @@
 # limitations under the License.
 #
 
-import re
+from mkdocs_combine.filters import patterns
 
 
 class MathFilter:
     r"""Turn the \( \) Markdown math notation into LaTex $$ inlines"""
 
-    def run(self, lines):
-        """Filter method"""
-        ret = []
+    def filter_line(self, line):
+        """Filters a single line"""
+        return patterns.MATH.sub(r"$\1$", line)
+
+    def stream(self, lines):
+        """Filter method for iterables: yields filtered lines one by one"""
         for line in lines:
-            ret.append(re.sub(r"\\\((.*)\\\)", r"$\1$", line))
+            yield self.filter_line(line)
 
-        return ret
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
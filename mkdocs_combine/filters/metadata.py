@@ -14,22 +14,23 @@
 # limitations under the License.
 #
 
-import re
+from mkdocs_combine.filters import patterns
 
 
 class MetadataFilter:
     r"""Turn the \( \) Markdown math notation into LaTex $$ inlines"""
 
-    def run(self, lines):
-        """Filter method"""
-        ret = []
+    def stream(self, lines):
+        """Filter method for iterables: yields the filtered lines"""
         header = True
         for line in lines:
             if header:
-                if not re.match(r"^[a-zA-Z\ ]:", line):
+                if not patterns.METADATA.match(line):
                     header = False
-                    ret.append(line)
+                    yield line
             else:
-                ret.append(line)
+                yield line
 
-        return ret
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
@@ -0,0 +1,62 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# patterns.py - regular expressions shared by the filters, compiled once
+
+import re
+
+# HTML anchor tags (AnchorFilter)
+ANCHOR = re.compile(r"<a.*?</a>")
+
+# \( \) math notation (MathFilter)
+MATH = re.compile(r"\\\((.*)\\\)")
+
+# Python-Markdown [TOC] keyword (TocFilter)
+TOC = re.compile(r"^\s*\[TOC\]\s*")
+
+# ATX headers and headers nested deeper than Markdown allows (HeadlevelFilter)
+HEADING = re.compile(r"^#")
+HEADING_OVERFLOW = re.compile(r"^#######+")
+
+# The text of an ATX header, without closing hashes or attribute list
+# (XrefIndex)
+HEADING_TEXT = re.compile(r"^#+\s*(.*?)(?:\s*\{:?[^}]*\})?[\s#]*$")
+
+# YAML metadata lines at the top of a page (MetadataFilter)
+METADATA = re.compile(r"^[a-zA-Z\ ]:")
+
+# MkDocs-style cross-references (XrefFilter)
+XREF = re.compile(r"[^!]\[([^\]]+?)\]\(([^http].*?)\)")
+
+# Images, URLs and file extensions (ImageFilter)
+IMAGE = re.compile(r"!\[(.*?)\]\((.*?)\)")
+URL = re.compile(r"\w+://")
+EXTENSION = re.compile(r"\.\w+$")
+
+# The title after an image target (MkDocsCombiner.dependencies())
+IMAGE_TITLE = re.compile(r"\s+[\"'(].*$")
+
+# markdown_include statements (IncludeFilter): {!file!} as markdown_include
+# up to 0.5 reads them, and {!file!} or {!file!lines=1 3-5} as it reads them
+# from 0.6 on
+INCLUDE_LEGACY = re.compile(r"\{!\s*(.+?)\s*!\}")
+INCLUDE = re.compile(r"\{!\s*(.+?)\s*!(?:lines=([0-9 -]+))?\}")
+
+# Links inside table cells (TableFilter)
+LINK = re.compile(r"\[(.*?)\]\(.*?\)")
+
+# Lines that may be the delimiter row below a pipe table's header: nothing
+# but pipes, colons, dashes and spaces (TableFilter)
+TABLE_DELIMITER = re.compile(r"^ *[|:-][ |:-]*$")
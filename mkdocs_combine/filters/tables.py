@@ -16,119 +16,92 @@
 #
 # mdtableconv.py - converts pipe tables to Pandoc's grid tables
 
-import re
 import textwrap
 
-import markdown.blockparser
 import markdown.extensions.tables as tbl
+from mkdocs_combine.filters import blocks, patterns
 
 
-class TableFilter(tbl.TableProcessor):
-    def __init__(self, width=100, encoding="utf-8"):
-        self.width = width
-        self.width_default = 20  # Default column width for rogue rows with more cells than the first row.
-
-    def blocks(self, lines):
-        """Groups lines into markdown blocks"""
-        state = markdown.blockparser.State()
-        blocks = []
-
-        # We use three states: start, ``` and '\n'
-        state.set("start")
-
-        # index of current block
-        currblock = 0
-
-        for line in lines:
-            line += "\n"
-            if state.isstate("start"):
-                if line[:3] == "```":
-                    state.set("```")
-                else:
-                    state.set("\n")
-                blocks.append("")
-                currblock = len(blocks) - 1
-            else:
-                marker = line[:3]  # Will capture either '\n' or '```'
-                if state.isstate(marker):
-                    state.reset()
-            blocks[currblock] += line
-
-        return blocks
+class GridLayout:
+    """Lays out the cells of a table as a Pandoc grid table. Keeps one
+    TextWrapper per column width, shared by all cells and tables of that
+    width. Cells of plain ASCII words separated by single spaces are wrapped
+    by a simpler greedy algorithm that produces the same result as
+    TextWrapper; this can be switched off with `fast_wrap`."""
 
-    def convert_table(self, block):
-        """ "Converts a table to grid table format"""
-        lines_orig = block.split("\n")
-        lines_orig.pop()  # Remove extra newline at end of block
-        widest_cell = []  # Will hold the width of the widest cell for each column
-        widest_word = []  # Will hold the width of the widest word for each column
-        widths = []  # Will hold the computed widths of grid table columns
+    def __init__(self, width=100, width_default=20, fast_wrap=True):
+        self.width = width
+        self.width_default = width_default
+        self.fast_wrap = fast_wrap
+        self.wrappers = {}
 
-        rows = []  # Will hold table cells during processing
-        lines = []  # Will hold the finished table
+    def render(self, rows):
+        """Converts rows of cells (header row, divider row, body rows) to the
+        lines of a grid table"""
+        lines = []
 
-        has_border = False  # Will be set to True if this is a bordered table
+        widths = self.column_widths(*self.measure(rows))
 
-        width_unit = 0.0  # This number is used to divide up self.width according
-        # to the following formula:
-        #
-        # self.width = width_unit * maxwidth
-        #
-        # Where maxwidth is the sum over all elements of
-        # widest_cell.
+        # Remove table header divider line from rows
+        rows = rows[:1] + rows[2:]
 
-        # Only process tables, leave everything else untouched
+        lines.append(self.ruler_line(widths, linetype="-"))
 
-        if not self.test(None, block):
-            return lines_orig
+        # Only add header row if it contains more than just whitespace
+        if "".join(rows[0]).strip() != "":
+            lines.extend(self.wrap_row(widths, rows[0]))
+            lines.append(self.ruler_line(widths, linetype="="))
 
-        if lines_orig[0].startswith("|"):
-            has_border = True
+        for row in rows[1:]:
+            # Skip empty rows
+            if "".join(row).strip() == "":
+                continue
+            lines.extend(self.wrap_row(widths, row))
+            lines.append(self.ruler_line(widths, linetype="-"))
 
-        # Initialize width arrays
+        # Append empty line after table
+        lines.append("")
 
-        for i in range(0, len(self._split_row(lines_orig[0], has_border))):
-            widest_cell.append(0)
-            widest_word.append(0)
-            widths.append(0)
+        return lines
 
-        # Parse lines into array of cells and record width of widest cell/word
+    def measure(self, rows):
+        """Returns the width of the widest cell and of the widest word in each
+        column"""
+        columns = max(len(row) for row in rows)
+        widest_cell = [0] * columns
+        widest_word = [0] * columns
 
-        for line in lines_orig:
-            row = self._split_row(line, has_border)
-            # pad widest_cell to account for under length first row
-            for i in range(0, len(row) - len(widest_cell)):
-                widest_cell.append(0)
-                widest_word.append(0)
-                widths.append(0)
-            for i in range(0, len(row)):
+        for row in rows:
+            for i, cell in enumerate(row):
                 # Record cell width
-                if len(row[i]) > widest_cell[i]:
-                    widest_cell[i] = len(row[i])
+                if len(cell) > widest_cell[i]:
+                    widest_cell[i] = len(cell)
                 # Record longest word
-                words = row[i].split()
-                for word in words:
+                for word in cell.split():
                     # Keep URLs from throwing the word length count off too badly.
-                    match = re.match(r"\[(.*?)\]\(.*?\)", word)
-                    if match:
-                        word = match.group(1)
+                    if word[0] == "[":
+                        match = patterns.LINK.match(word)
+                        if match:
+                            word = match.group(1)
 
                     if len(word) > widest_word[i]:
                         widest_word[i] = len(word)
-            rows.append(row)
 
-        # Remove table header divider line from rows
-        rows.pop(1)
+        return widest_cell, widest_word
 
-        # Compute first approximation of column widths based on maximum cell width
+    def column_widths(self, widest_cell, widest_word):
+        """Divides the table width among the columns"""
 
-        for width in widest_cell:
-            width_unit += float(width)
+        # Compute first approximation of column widths based on maximum cell
+        # width, dividing up self.width according to the following formula:
+        #
+        # self.width = width_unit * maxwidth
+        #
+        # Where maxwidth is the sum over all elements of widest_cell.
 
-        width_unit = self.width / width_unit
+        width_unit = self.width / float(sum(widest_cell))
 
-        for i in range(0, len(widest_cell)):
-            widths[i] = int(widest_cell[i] * width_unit)
+        widths = [int(w * width_unit) for w in widest_cell]
 
         # Add rounding errors to narrowest column
         if sum(widths) < self.width:
@@ -148,33 +121,40 @@ class TableFilter(tbl.TableProcessor):
                         widths[i] += offset
                         offset = 0
 
-        lines.append(self.ruler_line(widths, linetype="-"))
-
-        # Only add header row if it contains more than just whitespace
-        if "".join(rows[0]).strip() != "":
-            lines.extend(self.wrap_row(widths, rows[0]))
-            lines.append(self.ruler_line(widths, linetype="="))
-
-        for row in rows[1:]:
-            # Skip empty rows
-            if "".join(row).strip() == "":
-                continue
-            lines.extend(self.wrap_row(widths, row))
-            lines.append(self.ruler_line(widths, linetype="-"))
-
-        # Append empty line after table
-        lines.append("")
-
-        return lines
-
-    def run(self, lines):
-        """Filter method: Passes all blocks through convert_table() and returns a list of lines."""
-        ret = []
-
-        for block in self.blocks(lines):
-            ret.extend(self.convert_table(block))
-
-        return ret
+        return widths
+
+    def wrapper(self, width):
+        """Returns the (shared) TextWrapper for a column width"""
+        tw = self.wrappers.get(width)
+        if tw is None:
+            tw = textwrap.TextWrapper(width=width, break_on_hyphens=False)
+            self.wrappers[width] = tw
+        return tw
+
+    def wrap(self, text, width):
+        """Wraps and left-justifies the text of a cell to `width` columns"""
+        if self.fast_wrap and text.isascii():
+            words = text.split()
+            # Only plain words separated by single spaces that all fit the
+            # column: anything else is left to TextWrapper. Surrounding
+            # spaces and tabs don't matter, dedent() and TextWrapper drop them.
+            if (
+                words
+                and " ".join(words) == text.strip(" \t")
+                and max(map(len, words)) <= width
+            ):
+                lines = []
+                line = words[0]
+                for word in words[1:]:
+                    if len(line) + 1 + len(word) <= width:
+                        line += " " + word
+                    else:
+                        lines.append(line)
+                        line = word
+                lines.append(line)
+                return lines
+
+        return self.wrapper(width).wrap(textwrap.dedent(text))
 
     def ruler_line(self, widths, linetype="-"):
         """Generates a ruler line for separating rows from each other"""
@@ -199,12 +179,8 @@ class TableFilter(tbl.TableProcessor):
             if i < len(widths):
                 w = widths[i]
 
-            tw = textwrap.TextWrapper(width=w, break_on_hyphens=False)
-            # Wrap and left-justify
-            row[i] = tw.wrap(textwrap.dedent(row[i]))
-            # Pad with spaces up to to fixed column width
-            for l in range(0, len(row[i])):
-                row[i][l] += (w - len(row[i][l])) * " "
+            # Wrap, left-justify and pad with spaces up to fixed column width
+            row[i] = [l + (w - len(l)) * " " for l in self.wrap(row[i], w)]
             if len(row[i]) > longest:
                 longest = len(row[i])
 
@@ -217,8 +193,7 @@ class TableFilter(tbl.TableProcessor):
                 w = widths[i]
 
             if len(row[i]) < longest:
-                for j in range(len(row[i]), longest):
-                    row[i].append(w * " ")
+                row[i].extend([w * " "] * (longest - len(row[i])))
 
         for l in range(0, longest):
             line = []
@@ -228,3 +203,72 @@ class TableFilter(tbl.TableProcessor):
             lines.append(line)
 
         return lines
+
+
+class TableFilter(tbl.TableProcessor):
+    def __init__(self, width=100, encoding="utf-8", fast_wrap=True):
+        self.width = width
+        self.width_default = 20  # Default column width for rogue rows with more cells than the first row.
+        self.layout = GridLayout(self.width, self.width_default, fast_wrap)
+
+    def blocks(self, lines):
+        """Groups lines into markdown blocks"""
+        return [blocks.join(lines, start, end) for start, end in blocks.spans(lines)]
+
+    def convert_table(self, block):
+        """ "Converts a table to grid table format"""
+        lines_orig = block.split("\n")
+        lines_orig.pop()  # Remove extra newline at end of block
+
+        # Only process tables, leave everything else untouched
+
+        if not self.test(None, block):
+            return lines_orig
+
+        # test() has recorded whether this is a bordered table, which is
+        # what _split_row() goes by.
+        rows = [self._split_row(line) for line in lines_orig]
+
+        return self.layout.render(rows)
+
+    def is_candidate(self, lines, start, end):
+        """Cheap pre-screen for TableProcessor.test(): a table needs a pipe in
+        its header row and a delimiter row directly below it."""
+        header = lines[start]
+        if "|" not in header:
+            return False
+        if "\n" in header:
+            # Lines converted by an earlier filter may span several rows
+            header, delimiter = (header.split("\n") + [""])[:2]
+        elif end - start > 1:
+            delimiter = lines[start + 1].split("\n", 1)[0]
+        else:
+            return False
+        return patterns.TABLE_DELIMITER.match(delimiter) is not None
+
+    def stream(self, lines):
+        """Filter method for iterables: converts blocks as soon as they are
+        complete and yields the resulting lines"""
+        for block in blocks.iter_blocks(lines):
+            if self.is_candidate(block, 0, len(block)):
+                yield from self.convert_table(blocks.join(block))
+            else:
+                yield from block
+
+    def run(self, lines):
+        """Filter method: Passes all blocks through convert_table() and returns a list of lines."""
+        ret = []
+        for start, end in blocks.spans(lines):
+            if self.is_candidate(lines, start, end):
+                ret.extend(self.convert_table(blocks.join(lines, start, end)))
+            else:
+                ret.extend(lines[start:end])
+        return ret
+
+    def ruler_line(self, widths, linetype="-"):
+        """Generates a ruler line for separating rows from each other"""
+        return self.layout.ruler_line(widths, linetype)
+
+    def wrap_row(self, widths, row, width_default=None):
+        """Wraps a single line table row into a fixed width, multi-line table."""
+        return self.layout.wrap_row(widths, row, width_default)
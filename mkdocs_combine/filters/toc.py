@@ -13,16 +13,21 @@
 # limitations under the License.
 #
 
-import re
+from mkdocs_combine.filters import patterns
 
 
 class TocFilter:
     """Strips out python-markdown [TOC] keyword"""
 
-    def run(self, lines):
-        """Filter method"""
-        ret = []
+    def filter_line(self, line):
+        """Filters a single line"""
+        return patterns.TOC.sub("", line)
+
+    def stream(self, lines):
+        """Filter method for iterables: yields filtered lines one by one"""
         for line in lines:
-            ret.append(re.sub(r"^\s*\[TOC\]\s*", "", line))
+            yield self.filter_line(line)
 
-        return ret
+    def run(self, lines):
+        """Filter method"""
+        return list(self.stream(lines))
@@ -13,28 +13,202 @@
 # limitations under the License.
 #
 
-import re
+import hashlib
+import json
+import posixpath
 
-# TODO: Implement working cross-references (for now they are simply replaced by
-#       their link titles).
+from mkdocs_combine.filters import patterns
+
+
+def slugify(value):
+    """Python-Markdown's toc slugify(), imported on first use since only
+    resolving cross-references needs Python-Markdown"""
+    from markdown.extensions.toc import slugify
+
+    return slugify(value, "-")
+
+
+class XrefIndex:
+    """Maps pages and their headings to unique anchors in the combined
+    document, so cross-references between pages can be resolved with a
+    single lookup per link.
+
+    Headings are found the same way HeadlevelFilter finds them (ATX headers
+    outside of code blocks). Within a page, heading slugs are made unique the
+    way Python-Markdown's toc extension does it, so `page.md#heading` links
+    written for MkDocs keep working. The scan of each page is memoized by the
+    page's content, and the whole index can be saved to and loaded from a
+    JSON file to reuse these scans between runs.
+    """
+
+    def __init__(self):
+        self.pages = {}  # file -> {"anchor": ..., "headings": {slug: anchor}, "ids": [[index, anchor]]}
+        self.scans = {}  # content digest -> [[index, slug or None]]
+        self.anchors = set()
+
+    def to_dict(self):
+        return {"pages": self.pages, "scans": self.scans}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.pages = data.get("pages", {})
+        index.scans = data.get("scans", {})
+        for entry in index.pages.values():
+            index.anchors.update(anchor for i, anchor in entry["ids"])
+        return index
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Returns the index saved at `path`, or an empty index"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return cls()
+
+    def digest(self, lines):
+        return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+    def scan(self, lines):
+        """Returns [index, slug] pairs for the headings in a page's lines. The
+        page title added by ChapterheadFilter has a slug of None."""
+        headings = []
+        seen = set()
+        not_in_code_block = True
+        for i, line in enumerate(lines):
+            if "```" in line:
+                not_in_code_block = not not_in_code_block
+            if not_in_code_block and line.startswith("#"):
+                if line.endswith("{: .page-title}"):
+                    headings.append([i, None])
+                    continue
+                slug = slugify(patterns.HEADING_TEXT.match(line).group(1))
+                # Same scheme as markdown.extensions.toc.unique()
+                if slug in seen:
+                    n = 1
+                    while f"{slug}_{n}" in seen:
+                        n += 1
+                    slug = f"{slug}_{n}"
+                seen.add(slug)
+                headings.append([i, slug])
+        return headings
+
+    def unique(self, anchor):
+        """Returns `anchor`, or a numbered variant of it if it is taken"""
+        if anchor in self.anchors:
+            n = 1
+            while f"{anchor}_{n}" in self.anchors:
+                n += 1
+            anchor = f"{anchor}_{n}"
+        self.anchors.add(anchor)
+        return anchor
+
+    def build(self, pages, results):
+        """Indexes the headings of all pages. `results` holds each page's lines
+        after the per-page filters ran. Pages whose lines are unchanged since
+        the last build (or the build the index was loaded from) are not
+        scanned again."""
+        previous, self.scans = self.scans, {}
+        self.pages = {}
+        self.anchors = set()
+
+        for page, lines in zip(pages, results):
+            if not page["file"]:
+                continue
+            digest = self.digest(lines)
+            headings = previous.get(digest)
+            if headings is None:
+                headings = self.scan(lines)
+            self.scans[digest] = headings
+
+            base = slugify(posixpath.splitext(page["file"])[0].replace("/", "-"))
+            entry = {"anchor": None, "headings": {}, "ids": []}
+            for i, slug in headings:
+                anchor = self.unique(f"{base}-{slug}" if slug else base)
+                if slug:
+                    entry["headings"][slug] = anchor
+                if entry["anchor"] is None:
+                    entry["anchor"] = anchor
+                entry["ids"].append([i, anchor])
+            self.pages[page["file"]] = entry
+
+    def lookup(self, filename, target):
+        """Returns the anchor a link to `target` from page `filename` points
+        to, or None if it does not point to a heading of an indexed page"""
+        path, _, fragment = target.partition("#")
+        if path:
+            path = posixpath.normpath(
+                posixpath.join(posixpath.dirname(filename or ""), path)
+            )
+        else:
+            path = filename
+
+        entry = self.pages.get(path)
+        if entry is None:
+            return None
+        if fragment:
+            return entry["headings"].get(fragment)
+        return entry["anchor"]
+
+    def annotate(self, page, lines):
+        """Adds the anchors of a page's headings to its lines as attribute
+        lists"""
+        entry = self.pages.get(page["file"])
+        if entry is None:
+            return lines
+
+        lines = list(lines)
+        for i, anchor in entry["ids"]:
+            line = lines[i]
+            if line.endswith("}") and "{:" in line:
+                lines[i] = f"{line[:-1].rstrip()} #{anchor}}}"
+            else:
+                # Closing hashes would end up in the heading's text
+                stripped = line.rstrip("#")
+                if stripped != line and stripped[-1:] in (" ", "\t"):
+                    line = stripped.rstrip()
+                lines[i] = f"{line} {{: #{anchor}}}"
+        return lines
 
 
 class XrefFilter:
-    """Replaces mkdocs style cross-references by just their title"""
+    """Replaces mkdocs style cross-references by just their title, or, given
+    an XrefIndex and the name of the page being filtered, by links to the
+    corresponding anchors in the combined document where possible"""
+
+    def __init__(self, index=None, filename=None):
+        self.index = index
+        self.filename = filename
+
+    def filter_line(self, line):
+        """Filters a single line. All cross-references are replaced in a single
+        left-to-right pass; a link butting up against the previous link's
+        closing parenthesis is left alone."""
+        if "](" not in line:
+            return line
+        return patterns.XREF.sub(self.replace, line)
+
+    def replace(self, match):
+        """Substitution callback: returns the title of a cross-reference or a
+        link to its anchor"""
+        if self.index is not None:
+            target = match.group(2).split()
+            anchor = target and self.index.lookup(self.filename, target[0])
+            if anchor:
+                # The pattern includes the character before the link
+                return f"{match.group(0)[0]}[{match.group(1)}](#{anchor})"
+        return match.group(1)
+
+    def stream(self, lines):
+        """Filter method for iterables: yields filtered lines one by one"""
+        for line in lines:
+            yield self.filter_line(line)
 
     def run(self, lines):
         """Filter method"""
-        ret = []
-        for line in lines:
-            while True:
-                match = re.search(r"[^!]\[([^\]]+?)\]\(([^http].*?)\)", line)
-                if match is not None:
-                    title = match.group(1)
-                    line = re.sub(
-                        r"[^!]\[[^\]]+?\]\([^http].*?\)", title, line, count=1
-                    )
-                else:
-                    break
-            ret.append(line)
-
-        return ret
+        return list(self.stream(lines))
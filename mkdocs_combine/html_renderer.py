@@ -0,0 +1,403 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# html_renderer.py - renders the combined document to HTML page by page
+
+import collections
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+
+import markdown
+import markdown.extensions.toc
+import markdown.treeprocessors
+
+from mkdocs_combine.cache import package_version
+
+# The toc extension's heading ids are rendered wrapped in these (private use)
+# characters, so that they can be made unique across all pages once the
+# pages are put together.
+ID_START = "\ue000"
+ID_END = "\ue001"
+MARKED_ID = re.compile(f"{ID_START}([^{ID_END}]*){ID_END}(?:_[0-9]+)?")
+
+# Extensions that number or collect things across the whole document
+# (footnotes, abbreviations). Documents using them are rendered in one piece.
+WHOLE_DOCUMENT_EXTENSIONS = {"abbr", "extra", "footnotes"}
+
+# Paragraphs rendered before and after each chunk of a document with more
+# than one and cut off again, so that a chunk ends with the same whitespace
+# it has in the whole document (Markdown strips the whitespace at the end of
+# its output). A chunk whose trailing boundary gets swallowed by a raw HTML
+# block it leaves open can't be rendered on its own.
+BOUNDARY = "mkdocscombinechunkboundary"
+BOUNDARY_HTML = f"<p>{BOUNDARY}</p>"
+
+# The attribute list ChapterheadFilter puts on page titles, with anything
+# added to it later (XrefIndex adds the anchor: {: .page-title #anchor})
+PAGE_TITLE = re.compile(r"\{:(?:[^}]*\s)?\.page-title(?:\s[^}]*)?\}$")
+FENCE = re.compile(r"^(`{3,}|~{3,})")
+HTML_BLOCK = re.compile(r"^<([a-zA-Z][a-zA-Z0-9]*)")
+COMMENT_START = "<!--"
+COMMENT_END = "-->"
+REFERENCE = re.compile(r"^ {0,3}\[[^\]]*\]:")
+
+
+class MarkedSlugify:
+    """toc extension slugify function that wraps the slugs of another one in
+    ID_START and ID_END"""
+
+    def __init__(self, slugify):
+        self.slugify = slugify
+
+    def __call__(self, value, separator):
+        return ID_START + self.slugify(value, separator) + ID_END
+
+
+class IdCollector(markdown.treeprocessors.Treeprocessor):
+    """Records the ids a page has before the toc extension runs: the ids it
+    keeps its own heading ids apart from"""
+
+    def __init__(self, md, ids):
+        super().__init__(md)
+        self.ids = ids
+
+    def run(self, root):
+        self.ids.extend(el.get("id") for el in root.iter() if "id" in el.attrib)
+
+
+def unique(anchor, used, resume):
+    """markdown.extensions.toc.unique(), but resumes the search for a free id
+    where the last search for the same id stopped (the ids it went past are
+    still taken). Keeps documents that repeat a heading many times from
+    taking quadratic time."""
+    start = anchor
+    anchor = resume.get(start, anchor)
+    while anchor in used or not anchor:
+        match = markdown.extensions.toc.IDCOUNT_RE.match(anchor)
+        if match:
+            anchor = "%s_%d" % (match.group(1), int(match.group(2)) + 1)
+        else:
+            anchor = "%s_%d" % (anchor, 1)
+    used.add(anchor)
+    resume[start] = anchor
+    return anchor
+
+
+def extension_name(name):
+    return name.rsplit(".", 1)[-1].split(":")[0]
+
+
+class HtmlRenderer:
+    """Renders the combined document to HTML in chunks, one chunk per page
+    (cut before the page titles, or before each heading if there are none),
+    reusing one markdown.Markdown instance for all chunks.
+
+    Rendered chunks are kept in memory and, if given, in `cache` (a
+    cache.PageCache), keyed by their content, so rendering a document again
+    only renders the pages that changed. With `jobs` > 1 (or 0/None for one
+    job per CPU) chunks are rendered on a process or thread pool.
+
+    The result is the same as rendering the document in one piece: heading
+    ids are made unique across the whole document the way the toc extension
+    does it, and link reference definitions apply to all pages. Documents
+    using extensions in WHOLE_DOCUMENT_EXTENSIONS are rendered in one piece,
+    and so are documents with a chunk that leaves a raw HTML block open
+    (which swallows the chunks after it).
+    """
+
+    def __init__(self, extensions, extension_configs=None, **kwargs):
+        self.extensions = list(extensions)
+        self.extension_configs = dict(extension_configs or {})
+        self.jobs = kwargs.get("jobs", 1)
+        self.pool = kwargs.get("pool", "process")
+        self.cache = kwargs.get("cache", None)
+        self.memo = {}
+        self.stats = collections.Counter()
+        self.local = threading.local()
+
+        names = {extension_name(name) for name in self.extensions}
+        self.sectioned = not names & WHOLE_DOCUMENT_EXTENSIONS
+        self.toc = None
+        for name in self.extensions:
+            if extension_name(name) == "toc":
+                self.toc = name
+
+        self.digest = hashlib.sha256(
+            json.dumps(
+                [package_version(), self.extensions, self.extension_configs],
+                sort_keys=True,
+                default=repr,
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def __getstate__(self):
+        # Worker processes render chunks only; they create their own Markdown
+        # instance and don't need the caches.
+        state = self.__dict__.copy()
+        state["memo"] = {}
+        state["cache"] = None
+        del state["local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def markdown(self):
+        """Returns the Markdown instance of the current thread"""
+        md = getattr(self.local, "md", None)
+        if md is not None:
+            return md
+
+        configs = dict(self.extension_configs)
+        if self.toc:
+            config = dict(configs.get(self.toc, {}))
+            config["slugify"] = MarkedSlugify(
+                config.get("slugify", markdown.extensions.toc.slugify)
+            )
+            configs[self.toc] = config
+
+        md = markdown.Markdown(
+            extensions=self.extensions,
+            extension_configs=configs,
+            output_format="html5",
+        )
+        self.local.ids = []
+        if self.toc:
+            # Just before the toc extension (5)
+            md.treeprocessors.register(
+                IdCollector(md, self.local.ids), "mkdocs_combine_ids", 6
+            )
+        self.local.md = md
+        return md
+
+    def convert(self, text, references=None, wrap=True):
+        """Renders one chunk, between boundary paragraphs if `wrap` is set.
+        Returns its HTML and the ids it had before the toc extension added
+        the heading ids, or None if a raw HTML block swallowed the trailing
+        boundary."""
+        md = self.markdown()
+        md.reset()
+        if references:
+            md.references.update(references)
+        del self.local.ids[:]
+        if not wrap:
+            return md.convert(text), list(self.local.ids)
+
+        html = md.convert(f"{BOUNDARY}\n\n{text}\n\n{BOUNDARY}")
+        start = len(BOUNDARY_HTML) + 1
+        end = html.rfind(BOUNDARY_HTML)
+        if not html.startswith(BOUNDARY_HTML) or end < start:
+            return None
+        # Keep what postprocessors added after the last paragraph
+        html = html[start:end] + html[end + len(BOUNDARY_HTML) :]
+        return html, list(self.local.ids)
+
+    def convert_many(self, texts, references=None, wrap=True):
+        return [self.convert(text, references, wrap) for text in texts]
+
+    def split(self, lines):
+        """Returns the (start, end) spans of the chunks of `lines` and the
+        indexes of the lines that may define link references. Chunks start
+        at headings that follow an empty line outside of fenced code and HTML
+        blocks and HTML comments: at page titles, or at all headings if there
+        are none."""
+        titles = []
+        headings = []
+        references = []
+        fence = None
+        html_tag = None
+        comment = False
+        depth = 0
+        blank = True
+        for i, line in enumerate(lines):
+            if fence:
+                if line.startswith(fence) and not line.strip().strip(fence[0]):
+                    fence = None
+            elif comment:
+                comment = COMMENT_END not in line
+            elif html_tag:
+                depth += line.count(f"<{html_tag}") - line.count(f"</{html_tag}>")
+                if depth <= 0:
+                    html_tag = None
+            elif blank and line.startswith("#") and i:
+                if PAGE_TITLE.search(line):
+                    titles.append(i)
+                headings.append(i)
+            elif FENCE.match(line):
+                fence = FENCE.match(line).group(1)
+            elif blank and line.startswith(COMMENT_START):
+                comment = COMMENT_END not in line[len(COMMENT_START) :]
+            elif blank and HTML_BLOCK.match(line):
+                html_tag = HTML_BLOCK.match(line).group(1)
+                # Like Markdown, an hr block ends on its line
+                if html_tag == "hr":
+                    html_tag = None
+                else:
+                    depth = line.count(f"<{html_tag}") - line.count(f"</{html_tag}>")
+                    if depth <= 0:
+                        html_tag = None
+            elif REFERENCE.match(line):
+                references.append(i)
+            blank = not line.strip()
+
+        starts = [0] + (titles or headings)
+        spans = list(zip(starts, starts[1:] + [len(lines)]))
+        return spans, references
+
+    def references(self, lines, indexes):
+        """Returns the link references defined on the lines at `indexes` (a
+        title may follow on the next line)"""
+        if not indexes:
+            return {}
+        candidates = sorted(set(indexes) | {i + 1 for i in indexes if i + 1 < len(lines)})
+        md = self.markdown()
+        md.reset()
+        md.convert("\n".join(lines[i] for i in candidates))
+        return dict(md.references)
+
+    def key(self, text, references, wrap=True):
+        h = hashlib.sha256()
+        h.update(self.digest.encode("utf-8"))
+        h.update(b"wrapped" if wrap else b"whole")
+        h.update(references.encode("utf-8"))
+        h.update(text.encode("utf-8"))
+        return h.hexdigest()
+
+    def lookup(self, key):
+        result = self.memo.get(key)
+        if result is None and self.cache is not None:
+            entry = self.cache.get(key)
+            if entry:
+                result = (entry[0], entry[1:])
+        return result
+
+    def render(self, lines):
+        """Renders the list of lines `lines` and returns the HTML"""
+        keys, texts, references, results = self.prepare(lines)
+        missing = [texts[i] for i, result in enumerate(results) if result is None]
+        rendered = self.map_convert(missing, references, len(texts) > 1)
+        html = self.finish(keys, results, rendered)
+        if html is None:
+            html = self.render_whole(lines)
+        return html
+
+    def prepare(self, lines):
+        """First step of render(): splits `lines` into chunks and looks them
+        up in the caches. Returns the chunks' keys and texts, the link
+        references and the cached results (None for the chunks still to be
+        rendered with convert_many(), wrapped if there is more than one
+        chunk)."""
+        if self.sectioned:
+            spans, indexes = self.split(lines)
+            references = self.references(lines, indexes)
+        else:
+            spans, references = [(0, len(lines))], {}
+        texts = ["\n".join(lines[start:end]) for start, end in spans]
+        digest = json.dumps(sorted(references.items()))
+        wrap = len(texts) > 1
+        keys = [self.key(text, digest, wrap) for text in texts]
+
+        results = [self.lookup(key) for key in keys]
+        misses = results.count(None)
+        self.stats["hits"] += len(results) - misses
+        self.stats["misses"] += misses
+        return keys, texts, references, results
+
+    def finish(self, keys, results, rendered):
+        """Last step of render(): fills the chunks missing from `results` in
+        with `rendered` (in order), caches them and returns the HTML. Returns
+        None if a chunk couldn't be rendered on its own; see render_whole()."""
+        if any(result is None for result in rendered):
+            return None
+        missing = [i for i, result in enumerate(results) if result is None]
+        for i, result in zip(missing, rendered):
+            results[i] = result
+            if self.cache is not None:
+                self.cache.put(keys[i], [result[0]] + result[1])
+
+        # Only keep the chunks of the current document
+        self.memo = dict(zip(keys, results))
+        return self.join(results)
+
+    def render_whole(self, lines):
+        """Renders `lines` in one piece and returns the HTML: the fallback for
+        documents with a chunk that can't be rendered on its own"""
+        self.stats["fallbacks"] += 1
+        text = "\n".join(lines)
+        key = self.key(text, "", wrap=False)
+        result = self.lookup(key)
+        if result is None:
+            self.stats["misses"] += 1
+            result = self.convert(text, wrap=False)
+            if self.cache is not None:
+                self.cache.put(key, [result[0]] + result[1])
+        else:
+            self.stats["hits"] += 1
+        self.memo = {key: result}
+        return self.join([result])
+
+    def map_convert(self, texts, references, wrap=True):
+        """Renders the chunks `texts`, on a pool if there are enough of them"""
+        if self.jobs == 1 or len(texts) < 2:
+            return self.convert_many(texts, references, wrap)
+
+        import concurrent.futures
+
+        workers = self.jobs or os.cpu_count() or 1
+        if self.pool == "thread":
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+        # A few batches per worker, so each worker sets up its Markdown
+        # instance a few times rather than once per chunk
+        size = max(1, len(texts) // (workers * 4))
+        batches = [texts[i : i + size] for i in range(0, len(texts), size)]
+        with executor:
+            results = executor.map(
+                self.convert_many,
+                batches,
+                itertools.repeat(references),
+                itertools.repeat(wrap),
+            )
+            return list(itertools.chain.from_iterable(results))
+
+    def join(self, results):
+        """Puts the chunks together, making their heading ids unique"""
+        if not self.toc:
+            return "".join(html for html, ids in results).strip()
+
+        used = set()
+        resume = {}
+        for html, ids in results:
+            used.update(ids)
+
+        parts = []
+        for html, ids in results:
+            chunk_ids = {}
+
+            def replace(match):
+                marked = match.group(0)
+                if marked not in chunk_ids:
+                    chunk_ids[marked] = unique(match.group(1), used, resume)
+                return chunk_ids[marked]
+
+            parts.append(MARKED_ID.sub(replace, html))
+        return "".join(parts).strip()
@@ -14,26 +14,31 @@
 # limitations under the License.
 #
 import codecs
+import collections
+import itertools
 import os
-import sys
-
-import markdown
-import mkdocs.config
-import mkdocs.utils
-import mkdocs_combine.filters.admonitions
+import threading
+import time
+import urllib.parse
+
+# MkDocs, Python-Markdown and the filters built on it are imported where they
+# are used, so the command line tool starts quickly and flags that don't need
+# them don't pay for importing them.
+import mkdocs_combine.cache
 import mkdocs_combine.filters.anchors
-import mkdocs_combine.filters.chapterhead
-import mkdocs_combine.filters.exclude
-import mkdocs_combine.filters.headlevels
-import mkdocs_combine.filters.images
-import mkdocs_combine.filters.include
+import mkdocs_combine.filters.chain
 import mkdocs_combine.filters.math
-import mkdocs_combine.filters.metadata
-import mkdocs_combine.filters.tables
+import mkdocs_combine.filters.patterns
 import mkdocs_combine.filters.toc
 import mkdocs_combine.filters.xref
+import mkdocs_combine.nav
+import mkdocs_combine.page_processor
 from mkdocs_combine.exceptions import FatalError
 
+# MkDocs keeps state on the config options shared by all configs while it
+# loads one, so threads (the sites of mkdocscombine serve) load them in turn
+CONFIG_LOCK = threading.Lock()
+
 
 class MkDocsCombiner:
     """Top level converter class. Instantiate separately for each mkdocs.yml."""
@@ -44,6 +49,7 @@ class MkDocsCombiner:
         self.exclude = kwargs.get("exclude", None)
         self.filter_tables = kwargs.get("filter_tables", True)
         self.filter_xrefs = kwargs.get("filter_xrefs", True)
+        self.resolve_xrefs = kwargs.get("resolve_xrefs", False)
         self.image_ext = kwargs.get("image_ext", None)
         self.strip_anchors = kwargs.get("strip_anchors", True)
         self.strip_metadata = kwargs.get("strip_metadata", True)
@@ -54,12 +60,47 @@ class MkDocsCombiner:
         self.increase_heads = kwargs.get("increase_heads", True)
         self.convert_admonition_md = kwargs.get("convert_admonition_md", False)
         self.verbose = kwargs.get("verbose", False)
+        self.jobs = kwargs.get("jobs", 1)
+        self.pool = kwargs.get("pool", "process")
+        self.prefetch = kwargs.get("prefetch", 8)
+        self.mmap_threshold = kwargs.get("mmap_threshold", 8 * 1024 * 1024)
+        self.cache_dir = kwargs.get("cache_dir", None)
+        self.cache_size = kwargs.get("cache_size", 256 * 1024 * 1024)
+        self.memory_cache = kwargs.get("memory_cache", False)
+        self.hooks = list(kwargs.get("hooks", ()))
+        self.xref_index = None
+        self.html_renderer = None
+        self.include_stats = collections.Counter()
+        self.inputs = {"pages": {}, "includes": {}, "images": {}}
         self.combined_md_lines = []
         self.html_bare = ""
         self.html = ""
 
         self.log("Arguments: " + str(kwargs))
 
+        self.page_cache = None
+        if self.cache_dir or self.memory_cache:
+            self.page_cache = mkdocs_combine.cache.PageCache(
+                self.cache_dir, self.cache_size, memory=self.memory_cache
+            )
+
+        self.load_config()
+
+    def add_hook(self, hook):
+        """Registers a callable that is called as hook(event, name, seconds,
+        lines) with the time spent in each step of a build (and the number of
+        lines it produced, where that applies). See profiler.Profiler for the
+        events."""
+        self.hooks.append(hook)
+
+    def emit(self, event, name, seconds, lines=None):
+        for hook in self.hooks:
+            hook(event, name, seconds, lines)
+
+    def load_config(self):
+        """(Re)loads the MkDocs configuration file and derives the filter
+        settings that depend on it."""
+        start = time.perf_counter()
         try:
             cfg = codecs.open(self.config_file, "r", self.encoding)
         except OSError as e:
@@ -68,7 +109,12 @@ class MkDocsCombiner:
                 1,
             )
 
-        self.config = mkdocs.config.load_config(config_file=self.config_file)
+        import mkdocs.config
+
+        with CONFIG_LOCK:
+            self.config = mkdocs.config.load_config(config_file=self.config_file)
+        # Set up again for the extensions of the new config when needed
+        self.html_renderer = None
 
         if "docs_dir" not in self.config:
             self.config["docs_dir"] = "docs"
@@ -98,6 +144,7 @@ class MkDocsCombiner:
                     self.filter_toc = True
 
         cfg.close()
+        self.emit("config", self.config_file, time.perf_counter() - start)
 
     def log(self, message):
         """Print messages if verbose mode is activated"""
@@ -105,65 +152,13 @@ class MkDocsCombiner:
             print("[mkdocscombine] " + message)
 
     def flatten_pages(self, pages, level=1):
-        """Recursively flattens pages data structure into a one-dimensional data structure"""
-        flattened = []
-
-        if sys.version_info.major < 3:
-            str_type = (str, self.encoding, unicode)
-        else:
-            str_type = (str, self.encoding)
-
-        for page in pages:
-            if type(page) in str_type:
-                flattened.append(
-                    {
-                        "file": page,
-                        "title": "%s {: .page-title}"
-                        % mkdocs.utils.filename_to_title(page),
-                        "level": level,
-                    }
-                )
-            if type(page) is list:
-                flattened.append(
-                    {
-                        "file": page[0],
-                        "title": "%s {: .page-title}" % page[1],
-                        "level": level,
-                    }
-                )
-            if type(page) is dict:
-                if type(list(page.values())[0]) in (str, self.encoding):
-                    flattened.append(
-                        {
-                            "file": list(page.values())[0],
-                            "title": "%s {: .page-title}" % list(page.keys())[0],
-                            "level": level,
-                        }
-                    )
-                if type(list(page.values())[0]) is list:
-                    # Add the parent section
-                    flattened.append(
-                        {
-                            "file": None,
-                            "title": "%s {: .page-title}" % list(page.keys())[0],
-                            "level": level,
-                        }
-                    )
-                    # Add children sections
-                    flattened.extend(
-                        self.flatten_pages(list(page.values())[0], level + 1)
-                    )
-        return flattened
-
-    def combine(self):
-        """User-facing conversion method. Returns combined document as a list of lines."""
-        lines = []
-
-        if self.verbose:
-            self.log("Running mkdocs-combine in verbose mode")
-
-        self.log(f"Configuration: {self.config}")
+        """Flattens the pages data structure into a one-dimensional list of
+        nav.Page objects"""
+        return mkdocs_combine.nav.flatten_nav(pages, level)
 
+    def get_pages(self):
+        """Returns the flattened list of pages from the "pages" or "nav"
+        configuration property"""
         pages = []
         if "pages" in self.config and self.config["pages"] is not None:
             pages = self.flatten_pages(self.config["pages"])
@@ -172,111 +167,407 @@ class MkDocsCombiner:
             if "nav" in self.config and self.config["nav"] is not None:
                 pages = self.flatten_pages(self.config["nav"])
                 self.log('Pages (using "nav" property): ')
+        return pages
 
-        f_exclude = mkdocs_combine.filters.exclude.ExcludeFilter(exclude=self.exclude)
+    def iter_page_lines(self, pages):
+        """Runs the per-page filters and yields the lines of all pages, with
+        separators between pages"""
+        return self.page_lines(self.iter_pages(pages))
 
-        f_include = mkdocs_combine.filters.include.IncludeFilter(
-            base_path=self.config["docs_dir"], encoding=self.encoding
-        )
+    def iter_pages(self, pages):
+        """Runs the per-page filters and yields (page, lines) for all pages"""
 
         # First, do the processing that must be done on a per-file basis:
         # Adjust header levels, insert chapter headings and adjust image paths.
+        processor = self.page_processor(pages)
 
-        f_headlevel = mkdocs_combine.filters.headlevels.HeadlevelFilter(pages)
-
-        for page in pages:
-            lines_tmp = []
-            if page["file"]:
-                fname = os.path.join(self.config["docs_dir"], page["file"])
-                try:
-                    with codecs.open(fname, "r", self.encoding) as p:
-                        for line in p.readlines():
-                            lines_tmp.append(line.rstrip())
-                except OSError as e:
-                    raise FatalError(
-                        f"Couldn't open {fname} for reading: {e.strerror}", 1
-                    )
-
-            f_chapterhead = mkdocs_combine.filters.chapterhead.ChapterheadFilter(
-                headlevel=page["level"], title=page["title"]
-            )
-
-            f_image = mkdocs_combine.filters.images.ImageFilter(
-                filename=page["file"],
-                image_path=self.config["site_dir"],
-                image_ext=self.image_ext,
-            )
-
-            if self.exclude:
-                lines_tmp = f_exclude.run(lines_tmp)
+        if self.jobs != 1:
+            self.log(f"Processing pages with {self.jobs or 'all'} {self.pool} jobs")
 
-            if self.filter_include:
-                lines_tmp = f_include.run(lines_tmp)
-
-            lines_tmp = mkdocs_combine.filters.metadata.MetadataFilter().run(lines_tmp)
-            if self.increase_heads:
-                lines_tmp = f_headlevel.run(lines_tmp)
-            if self.add_chapter_heads:
-                lines_tmp = f_chapterhead.run(lines_tmp)
-            lines_tmp = f_image.run(lines_tmp)
-            lines.extend(lines_tmp)
+        results = processor.map(
+            pages, jobs=self.jobs, pool=self.pool, on_page=self.page_done
+        )
+        if self.resolve_xrefs:
+            results = self.resolve_page_xrefs(pages, list(results))
+
+        yield from zip(pages, results)
+        self.prune_cache()
+
+    def page_processor(self, pages):
+        """Returns the PageProcessor for `pages` and starts recording the
+        inputs and include cache counters of a build with it"""
+        if self.cache_dir:
+            self.log(f"Using page cache in {self.cache_dir}")
+
+        processor = mkdocs_combine.page_processor.PageProcessor(
+            pages,
+            docs_dir=self.config["docs_dir"],
+            site_dir=self.config["site_dir"],
+            encoding=self.encoding,
+            exclude=self.exclude,
+            image_ext=self.image_ext,
+            filter_include=self.filter_include,
+            increase_heads=self.increase_heads,
+            add_chapter_heads=self.add_chapter_heads,
+            cache=self.page_cache,
+            prefetch=self.prefetch,
+            mmap_threshold=self.mmap_threshold,
+            profile=bool(self.hooks),
+        )
+        # Updated while the pages are processed
+        self.include_stats = processor.include_stats
+        # Filled in by page_done()
+        self.inputs = {"pages": {}, "includes": {}, "images": {}}
+        return processor
+
+    def prune_cache(self):
+        """Evicts the page cache entries the last build didn't use, if the
+        cache is over its size limit"""
+        if self.page_cache:
+            evicted = self.page_cache.prune()
+            if evicted:
+                self.log(f"Evicted {evicted} entries from page cache")
+
+    def page_lines(self, results):
+        """Yields the lines of the (page, lines) pairs `results`, with
+        separators between pages"""
+        for page, lines_tmp in results:
+            yield from lines_tmp
             # Add an empty line between pages to prevent text from a previous
             # file from butting up against headers in a subsequent file.
-            lines.append("")
+            yield ""
             if self.add_page_break:
-                lines.append("\\newpage")
-                lines.append("")
+                yield "\\newpage"
+                yield ""
+
+    def page_done(self, page, lines, info):
+        """Records the files a page was made from (see dependencies()) and
+        reports its timings to the hooks"""
+        if page["file"]:
+            self.record_inputs(page, info)
+        if not self.hooks:
+            return
+
+        name = page["file"] or page["title"]
+        self.emit("read", name, info["io"])
+        self.emit("page", name, info["filter"], len(lines))
+        for f_name, (seconds, count) in info["filters"].items():
+            if f_name != "decode":
+                self.emit("filter", f_name, seconds, count)
+
+    def record_inputs(self, page, info):
+        docs_dir = self.config["docs_dir"]
+        page_dir = os.path.join(docs_dir, os.path.dirname(page["file"]))
+        self.inputs["pages"][os.path.join(docs_dir, page["file"])] = None
+        for dep in info["deps"]:
+            self.inputs["includes"][dep] = None
+        title = mkdocs_combine.filters.patterns.IMAGE_TITLE
+        for image in info["images"]:
+            image = title.sub("", image).strip("<>")
+            # data:, mailto: and other URLs (but not Windows drive letters)
+            if len(urllib.parse.urlsplit(image).scheme) > 1:
+                continue
+            if image.startswith("/"):
+                image = os.path.join(docs_dir, image.lstrip("/"))
+            else:
+                image = os.path.join(page_dir, image)
+            self.inputs["images"][os.path.normpath(image)] = None
+
+    def dependencies(self):
+        """Returns the files the last combined document was made from: the
+        config file ("config"), the pages ("pages"), the files they include
+        ("includes") and the local images they reference ("images"), each in
+        the order they were first used. Included files and images that don't
+        exist are listed too."""
+        return {
+            "config": self.config_file,
+            "pages": list(self.inputs["pages"]),
+            "includes": list(self.inputs["includes"]),
+            "images": list(self.inputs["images"]),
+        }
+
+    def resolve_page_xrefs(self, pages, results):
+        """Indexes the headings of all pages, then gives them anchors and points
+        the cross-references between pages to these anchors. Needs all pages
+        at once, since a page may link to any page after it."""
+        index_file = None
+        if self.cache_dir:
+            index_file = os.path.join(self.cache_dir, "xref-index.json")
+
+        index = self.xref_index
+        if index is None:
+            if index_file:
+                index = mkdocs_combine.filters.xref.XrefIndex.load(index_file)
+            else:
+                index = mkdocs_combine.filters.xref.XrefIndex()
+        index.build(pages, results)
+        self.xref_index = index
+
+        if index_file:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                index.save(index_file)
+            except OSError:
+                pass
+
+        resolved = []
+        for page, lines in zip(pages, results):
+            if page["file"]:
+                lines = index.annotate(page, lines)
+                f_xref = mkdocs_combine.filters.xref.XrefFilter(
+                    index=index, filename=page["file"]
+                )
+                lines = f_xref.run(lines)
+            resolved.append(lines)
+        return resolved
+
+    def iter_lines(self):
+        """Streaming conversion method. Returns an iterator over the lines of
+        the combined document; pages are read and filtered as the iterator is
+        consumed."""
+        chain = self.build_filter_chain()
+        return self.filter_document(chain, self.iter_pages(self.get_pages()))
+
+    def filter_document(self, chain, results):
+        """Returns an iterator over the lines of the (page, lines) pairs
+        `results`, with separators between pages, run through the filters of
+        `chain` (see build_filter_chain())"""
+        lines = chain.stream(self.page_lines(results), source="pages")
+        if chain.timed:
+            lines = self.report_timings(chain, lines)
+        return lines
+
+    def build_filter_chain(self):
+        """Returns the chain of filters that runs over the whole document"""
+        if self.verbose:
+            self.log("Running mkdocs-combine in verbose mode")
+
+        self.log(f"Configuration: {self.config}")
+
+        chain = mkdocs_combine.filters.chain.FilterChain(
+            timed=self.verbose or bool(self.hooks)
+        )
 
         # Strip anchor tags
         if self.strip_anchors:
             self.log("Stripping anchor tags")
-            lines = mkdocs_combine.filters.anchors.AnchorFilter().run(lines)
+            chain.add(mkdocs_combine.filters.anchors.AnchorFilter())
 
         # Convert math expressions
         if self.convert_math:
             self.log("Converting math expressions")
-            lines = mkdocs_combine.filters.math.MathFilter().run(lines)
+            chain.add(mkdocs_combine.filters.math.MathFilter())
 
-        # Fix cross references
-        if self.filter_xrefs:
+        # Fix cross references (resolved ones are already fixed per page)
+        if self.resolve_xrefs:
+            self.log("Resolving cross references")
+        elif self.filter_xrefs:
             self.log("Fixing cross references")
-            lines = mkdocs_combine.filters.xref.XrefFilter().run(lines)
+            chain.add(mkdocs_combine.filters.xref.XrefFilter())
 
         # Convert admonitions already for Markdown output
         if self.convert_admonition_md:
             self.log("Converting admonitions to HTML in Markdown output")
-            lines = mkdocs_combine.filters.admonitions.AdmonitionFilter().run(lines)
+            from mkdocs_combine.filters import admonitions
+
+            chain.add(admonitions.AdmonitionFilter())
 
         if self.filter_toc:
             self.log("Creating TOC")
-            lines = mkdocs_combine.filters.toc.TocFilter().run(lines)
+            chain.add(mkdocs_combine.filters.toc.TocFilter())
 
         if self.filter_tables:
             self.log("Filtering tables")
-            lines = mkdocs_combine.filters.tables.TableFilter().run(lines)
+            from mkdocs_combine.filters import tables
+
+            chain.add(tables.TableFilter(width=self.width))
+
+        self.filter_chain = chain
+        return chain
+
+    def iter_parts(self, split="section", limit=None):
+        """Like iter_lines(), but splits the combined document into parts at
+        page boundaries and yields an iterator over the lines of each part
+        (each must be consumed before moving on to the next one). All parts
+        come from one pass over the pages.
+
+        `split` is "section" (a new part at each top-level section of the
+        nav), "pages" (at most `limit` pages per part) or "size" (a new part
+        once a part's pages take up `limit` bytes or more, measured before
+        the document-wide filters run). The document-wide filters run over
+        each part on its own; apart from blank lines where two parts meet, the
+        parts add up to the document iter_lines() returns."""
+        if split not in ("section", "pages", "size"):
+            raise ValueError(f"Unknown split {split!r}")
+        if split != "section" and not limit:
+            raise ValueError(f"Splitting by {split} needs a limit")
+
+        chain = self.build_filter_chain()
+        results = self.iter_pages(self.get_pages())
+        for part, group in itertools.groupby(results, self.part_numbers(split, limit)):
+            yield self.filter_document(chain, group)
+
+    def part_numbers(self, split, limit):
+        """Returns a function that maps the (page, lines) pairs of the
+        document, in order, to the numbers of the parts they go into"""
+        part = 0
+        pages = 0
+        size = 0
+
+        def number(result):
+            nonlocal part, pages, size
+            page, lines = result
+            if split == "section":
+                new = page["level"] == 1 and not page["file"]
+            elif split == "pages":
+                new = pages >= limit
+            else:
+                new = size >= limit
+            if new and (pages or size):
+                part += 1
+                pages = 0
+                size = 0
+
+            if page["file"]:
+                pages += 1
+            size += sum(len(line.encode(self.encoding)) + 1 for line in lines)
+            return part
 
-        self.combined_md_lines = lines
+        return number
+
+    def report_timings(self, chain, lines):
+        """Passes `lines` through and logs the filter chain's stage timings
+        and reports them to the hooks once they are exhausted"""
+        yield from lines
+        for name, seconds in chain.timings.items():
+            self.log(f"Stage {name}: {seconds:.3f}s")
+            if name != "pages":
+                self.emit("filter", name, seconds, chain.line_counts[name])
+
+    def combine(self):
+        """User-facing conversion method. Returns combined document as a list of lines."""
+        self.combined_md_lines = list(self.iter_lines())
         return self.combined_md_lines
 
+    async def acombine(self, executor=None):
+        """combine() for asyncio services: doesn't block the event loop, and
+        cancelling the task stops the build. CPU-bound filtering runs in
+        `executor` (see aio.combine())."""
+        from mkdocs_combine import aio
+
+        return await aio.combine(self, executor)
+
+    def combine_parts(self, split="section", limit=None):
+        """Conversion method that splits the document (see iter_parts()).
+        Returns the parts as lists of lines; combined_md_lines is set to the
+        whole document."""
+        parts = [list(lines) for lines in self.iter_parts(split, limit)]
+        self.combined_md_lines = list(itertools.chain.from_iterable(parts))
+        return parts
+
+    def combine_to_parts(self, path, split="section", limit=None):
+        """Streaming conversion method that splits the document (see
+        iter_parts()) and writes the parts with write_parts(). Returns the
+        paths of the parts."""
+        return self.write_parts(path, self.iter_parts(split, limit))
+
+    def write_parts(self, path, parts):
+        """Writes part 1 of `parts` (iterables of lines) to <path>-001<ext>
+        (for example out.md to out-001.md), part 2 to <path>-002<ext> and so
+        on. Returns the paths of the parts."""
+        paths = []
+        for number, lines in enumerate(parts, 1):
+            part_path = self.part_path(path, number)
+            try:
+                f = codecs.open(part_path, "w", encoding=self.encoding)
+            except OSError as e:
+                raise FatalError(
+                    f"Couldn't open {part_path} for writing: {e.strerror}", 1
+                )
+            with f:
+                self.write_lines(f, lines)
+            paths.append(part_path)
+        self.log(f"Wrote {len(paths)} parts")
+        return paths
+
+    @staticmethod
+    def part_path(path, number):
+        root, ext = os.path.splitext(path)
+        return f"{root}-{number:03d}{ext}"
+
+    def combine_to(self, f):
+        """Streaming conversion method. Writes the combined document to the
+        file object `f` line by line, without keeping it in memory (so
+        combined_md_lines is not set)."""
+        self.write_lines(f, self.iter_lines())
+
+    def write_lines(self, f, lines):
+        """Writes `lines` to the file object `f` and reports the time it took
+        to the hooks"""
+        first = True
+        count = 0
+        elapsed = 0.0
+        clock = time.perf_counter
+        for line in lines:
+            start = clock()
+            if not first:
+                f.write("\n")
+            f.write(line)
+            elapsed += clock() - start
+            first = False
+            count += 1
+        self.emit("write", str(getattr(f, "name", "output")), elapsed, count)
+
     def to_html(self):
-        md = "\n".join(self.combined_md_lines)
-        mkdocs_extensions = self.config.get("markdown_extensions", [])
-        extensions = ["markdown.extensions.attr_list"]
-        extension_configs = self.config.get("mdx_configs", [])
-        for ext in mkdocs_extensions:
-            if type(ext) is str or type(ext) is self.encoding:
-                extname = str(ext)
-                extensions.append(extname)
-            elif type(ext) is dict:
-                extname = str(ext.keys()[0])
-                extensions.append(extname)
-                extension_configs[extname] = ext[extname]
-        self.html_bare = markdown.markdown(
-            md,
-            extensions=extensions,
-            extension_configs=extension_configs,
-            output_format="html5",
+        """Renders the combined document (see combine()) to HTML page by page,
+        rendering only the pages that changed since the last call or that
+        aren't in the page cache (see html_renderer.HtmlRenderer)"""
+        start = time.perf_counter()
+        renderer = self.get_html_renderer()
+        stats = renderer.stats.copy()
+        html_bare = renderer.render(self.combined_md_lines)
+        return self.set_html(html_bare, renderer.stats - stats, start)
+
+    async def ato_html(self, executor=None):
+        """to_html() for asyncio services: doesn't block the event loop, and
+        cancelling the task stops the rendering. Chunks are rendered in
+        `executor` (see aio.to_html())."""
+        from mkdocs_combine import aio
+
+        return await aio.to_html(self, executor)
+
+    def get_html_renderer(self):
+        """Returns the HtmlRenderer for the Markdown extensions of the config,
+        creating it on first use"""
+        if self.html_renderer is None:
+            from mkdocs_combine import html_renderer
+
+            extensions = ["markdown.extensions.attr_list"]
+            extension_configs = dict(self.config.get("mdx_configs") or {})
+            for ext in self.config.get("markdown_extensions", []):
+                if type(ext) is str or type(ext) is self.encoding:
+                    extensions.append(str(ext))
+                elif type(ext) is dict:
+                    extname = str(list(ext.keys())[0])
+                    extensions.append(extname)
+                    extension_configs[extname] = ext[extname]
+            self.html_renderer = html_renderer.HtmlRenderer(
+                extensions,
+                extension_configs,
+                jobs=self.jobs,
+                pool=self.pool,
+                cache=self.page_cache,
+            )
+        return self.html_renderer
+
+    def set_html(self, html_bare, stats, start):
+        """Wraps the rendered document in a page, sets html_bare and html and
+        reports the chunk counters `stats` and the time since `start`"""
+        self.log(
+            f"Rendered {stats['misses']} of {stats['hits'] + stats['misses']} "
+            "HTML chunks"
         )
+        self.html_bare = html_bare
         self.html = """<!DOCTYPE html>
         <html lang="en">
         <head>
@@ -287,4 +578,7 @@ class MkDocsCombiner:
         </body>
         </html>
         """.format(self.html_bare)
+        self.emit(
+            "html", "to_html", time.perf_counter() - start, len(self.combined_md_lines)
+        )
         return self.html
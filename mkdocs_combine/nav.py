@@ -0,0 +1,86 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# nav.py - flattens the "nav" (or "pages") tree of an MkDocs config
+
+
+class Page:
+    """An entry of the flattened nav: a page file (None for a section
+    heading), its title in the nav and its nesting level. Items can also be
+    read like those of a dict (page["file"], page["title"], page["level"]).
+
+    The title is formatted when it is first read, as "<name> {: .page-title}";
+    pages listed without a name are named after their file.
+    """
+
+    __slots__ = ("file", "name", "level")
+
+    KEYS = ("file", "title", "level")
+
+    def __init__(self, file, name, level):
+        self.file = file
+        self.name = name
+        self.level = level
+
+    @property
+    def title(self):
+        name = self.name
+        if name is None:
+            import mkdocs.utils
+
+            name = mkdocs.utils.filename_to_title(self.file)
+        return "%s {: .page-title}" % name
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"Page(file={self.file!r}, name={self.name!r}, level={self.level!r})"
+
+
+def flatten_nav(nav, level=1):
+    """Flattens the nav tree of an MkDocs config into a list of Page objects,
+    in document order. Entries may be file names, [file, title] lists,
+    {title: file} dicts and {title: [entries]} sections; a section becomes a
+    Page without a file followed by its entries one level deeper. Walks the
+    tree with an explicit stack, so deep navs don't hit the recursion
+    limit."""
+    pages = []
+    append = pages.append
+    stack = [(iter(nav), level)]
+    while stack:
+        entries, level = stack[-1]
+        for entry in entries:
+            kind = type(entry)
+            if kind is str:
+                append(Page(entry, None, level))
+            elif kind is list:
+                append(Page(entry[0], entry[1], level))
+            elif kind is dict:
+                for name, value in entry.items():
+                    break
+                else:
+                    continue
+                if type(value) is str:
+                    append(Page(value, name, level))
+                elif type(value) is list:
+                    append(Page(None, name, level))
+                    stack.append((iter(value), level + 1))
+                    break
+        else:
+            stack.pop()
+    return pages
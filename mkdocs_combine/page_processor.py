@@ -0,0 +1,306 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# page_processor.py - runs the per-page filters on a single page
+
+import codecs
+import collections
+import itertools
+import mmap
+import os
+import time
+
+import mkdocs_combine.filters.chain
+import mkdocs_combine.filters.chapterhead
+import mkdocs_combine.filters.exclude
+import mkdocs_combine.filters.headlevels
+import mkdocs_combine.filters.images
+import mkdocs_combine.filters.metadata
+from mkdocs_combine.exceptions import FatalError
+
+
+class PageProcessor:
+    """Runs the per-page filters (exclude, include, metadata, head levels,
+    chapter heads and images) on one page at a time. Only holds option values
+    and stateless filters, so instances can be shipped to worker processes."""
+
+    def __init__(self, pages, **kwargs):
+        self.docs_dir = kwargs.get("docs_dir", "docs")
+        self.site_dir = kwargs.get("site_dir", "site")
+        self.encoding = kwargs.get("encoding", "utf-8")
+        self.exclude = kwargs.get("exclude", None)
+        self.image_ext = kwargs.get("image_ext", None)
+        self.filter_include = kwargs.get("filter_include", False)
+        self.increase_heads = kwargs.get("increase_heads", True)
+        self.add_chapter_heads = kwargs.get("add_chapter_heads", True)
+        self.cache = kwargs.get("cache", None)
+        self.prefetch = kwargs.get("prefetch", 8)
+        self.mmap_threshold = kwargs.get("mmap_threshold", 8 * 1024 * 1024)
+        self.profile = kwargs.get("profile", False)
+
+        # Image targets resolved by the ImageFilters of this build's pages
+        self.resolved_images = {}
+        self.f_exclude = mkdocs_combine.filters.exclude.ExcludeFilter(
+            exclude=self.exclude
+        )
+        # Counters of the include cache, see IncludeFilter
+        self.include_stats = collections.Counter()
+        self.f_include = None
+        if self.filter_include:
+            # Imported here since markdown_include (if installed) pulls in
+            # Python-Markdown
+            from mkdocs_combine.filters import include
+
+            self.f_include = include.IncludeFilter(
+                base_path=self.docs_dir, encoding=self.encoding, stats=self.include_stats
+            )
+        self.f_headlevel = mkdocs_combine.filters.headlevels.HeadlevelFilter(pages)
+
+    def options(self):
+        """Returns the options that influence the output of run(), for use as
+        part of cache keys"""
+        return {
+            "docs_dir": os.path.abspath(self.docs_dir),
+            "site_dir": os.path.abspath(self.site_dir),
+            "encoding": self.encoding,
+            "exclude": self.exclude,
+            "image_ext": self.image_ext,
+            "filter_include": self.filter_include,
+            "include_legacy": self.f_include.legacy if self.f_include else None,
+            "increase_heads": self.increase_heads,
+            "add_chapter_heads": self.add_chapter_heads,
+            "offset": self.f_headlevel.offset,
+        }
+
+    def load(self, page):
+        """Returns the raw content of a page's source file. Files of at least
+        mmap_threshold bytes are memory-mapped instead of read."""
+        fname = os.path.join(self.docs_dir, page["file"])
+        try:
+            with open(fname, "rb") as p:
+                size = os.fstat(p.fileno()).st_size
+                if not self.mmap_threshold or size < self.mmap_threshold:
+                    return p.read()
+                data = mmap.mmap(p.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(data, "madvise"):
+                    data.madvise(mmap.MADV_SEQUENTIAL)
+                return data
+        except OSError as e:
+            raise FatalError(f"Couldn't open {fname} for reading: {e.strerror}", 1)
+
+    def decode(self, data):
+        """Splits raw page content into lines with trailing whitespace removed.
+        Memory-mapped content is decoded lazily: the lines are returned as an
+        iterator."""
+        if isinstance(data, mmap.mmap):
+            return self.iter_decode(data)
+        return [line.rstrip() for line in data.decode(self.encoding).splitlines()]
+
+    def iter_decode(self, data, blocksize=1024 * 1024):
+        """Yields the same lines as decode(), decoding `blocksize` bytes of
+        `data` at a time"""
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        tail = ""
+        for start in range(0, len(data), blocksize):
+            text = tail + decoder.decode(data[start : start + blocksize])
+            lines = text.splitlines(True)
+            # The last line may continue in the next block (even if it ends
+            # with "\r", which may be followed by "\n")
+            tail = lines.pop() if lines else ""
+            for line in lines:
+                yield line.rstrip()
+
+        for line in (tail + decoder.decode(b"", final=True)).splitlines():
+            yield line.rstrip()
+
+    def read(self, page, data=None):
+        """Returns the raw lines of a page's source file (decoded from `data`,
+        if its content was loaded already)"""
+        if not page["file"]:
+            return []
+        if data is None:
+            data = self.load(page)
+        return self.decode(data)
+
+    def load_ahead(self, pages, window):
+        """Yields (page, raw content, seconds spent loading it) in the order of
+        `pages`, loading up to `window` pages ahead of the consumer on a thread
+        pool. Content is None for pages without a file."""
+
+        import concurrent.futures
+
+        def load(page):
+            start = time.perf_counter()
+            data = self.load(page) if page["file"] else None
+            return data, time.perf_counter() - start
+
+        pages = iter(pages)
+        pending = collections.deque()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=window)
+        try:
+            for page in itertools.islice(pages, window):
+                pending.append((page, executor.submit(load, page)))
+            while pending:
+                page, future = pending.popleft()
+                for ahead in itertools.islice(pages, 1):
+                    pending.append((ahead, executor.submit(load, ahead)))
+                yield (page,) + future.result()
+        finally:
+            for page, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def filter(self, page, lines, deps=None, timings=None, images=None):
+        """Runs all per-page filters on the lines of a page. Appends the paths
+        of all included files to `deps` and the targets of all local images
+        (as written on the page) to `images`, if given. With `profile` set,
+        adds the time each filter took and the number of lines it produced to
+        the dict `timings` as name -> [seconds, lines], if given."""
+        f_chapterhead = mkdocs_combine.filters.chapterhead.ChapterheadFilter(
+            headlevel=page["level"], title=page["title"]
+        )
+
+        f_image = mkdocs_combine.filters.images.ImageFilter(
+            filename=page["file"],
+            image_path=self.site_dir,
+            image_ext=self.image_ext,
+            images=images,
+            resolved=self.resolved_images,
+        )
+
+        # The filters are chained as generators, so only the final list of
+        # lines is built.
+        chain = mkdocs_combine.filters.chain.FilterChain(timed=self.profile)
+        if self.exclude:
+            chain.add(self.f_exclude)
+
+        if self.filter_include:
+            chain.add(self.f_include.collecting(deps))
+
+        chain.add(mkdocs_combine.filters.metadata.MetadataFilter())
+        if self.increase_heads:
+            chain.add(self.f_headlevel)
+        if self.add_chapter_heads:
+            chain.add(f_chapterhead)
+        chain.add(f_image)
+
+        lines = list(chain.stream(lines, source="decode"))
+
+        if self.profile and timings is not None:
+            for name, seconds in chain.timings.items():
+                timings[name] = [seconds, chain.line_counts[name]]
+
+        return lines
+
+    def run(self, page, data=None, timings=None, deps=None, images=None):
+        """Reads a page (unless its raw content is passed as `data`) and
+        returns its lines after all per-page filters ran, from the page cache
+        if possible. See filter() for `timings`, `deps` and `images`."""
+        if not page["file"]:
+            return self.filter(page, [], timings=timings)
+
+        if data is None:
+            data = self.load(page)
+        try:
+            if self.cache is None:
+                return self.filter(page, self.decode(data), deps, timings, images)
+
+            key = self.cache.key(data, page, self.options())
+            page_deps = []
+            page_images = []
+            lines = self.cache.get(key, page_deps, page_images)
+            if lines is None:
+                lines = self.filter(
+                    page, self.decode(data), page_deps, timings, page_images
+                )
+                self.cache.put(key, lines, page_deps, page_images)
+            if deps is not None:
+                deps.extend(page_deps)
+            if images is not None:
+                images.extend(page_images)
+            return lines
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def work(self, page, data=None, io=0.0):
+        """run() for map(): returns the page's lines and a dict with the time
+        spent loading ("io") and filtering ("filter") the page, the per-filter
+        timings ("filters", see filter()), the changes to the include cache
+        counters ("includes"), which would otherwise stay in worker processes,
+        and the files the page included ("deps") and the images it references
+        ("images"). `io` is the time it took to load `data`, if given."""
+        before = self.include_stats.copy()
+        start = time.perf_counter()
+        if data is None and page["file"]:
+            data = self.load(page)
+        loaded = time.perf_counter()
+        timings = collections.OrderedDict()
+        deps = []
+        images = []
+        lines = self.run(page, data, timings, deps, images)
+        info = {
+            "io": io + loaded - start,
+            "filter": time.perf_counter() - loaded,
+            "filters": timings,
+            "includes": self.include_stats - before,
+            "deps": deps,
+            "images": images,
+        }
+        return lines, info
+
+    def map(self, pages, jobs=1, pool="process", on_page=None):
+        """Runs all pages through run() and yields their lines in the order of
+        `pages`. With jobs > 1 (or 0/None for one job per CPU) the pages are
+        processed on a process or thread pool. Otherwise page files are
+        loaded `prefetch` pages ahead on a thread pool, so reading overlaps
+        with filtering. If given, on_page(page, lines, info) is called for
+        each page with the info returned by work()."""
+        for page, (lines, info) in zip(pages, self.map_work(pages, jobs, pool)):
+            if on_page is not None:
+                on_page(page, lines, info)
+            yield lines
+
+    def map_work(self, pages, jobs, pool):
+        """Yields the results of work() for all pages"""
+        if jobs == 1 or len(pages) < 2:
+            if not self.prefetch or len(pages) < 2:
+                for page in pages:
+                    yield self.work(page)
+                return
+
+            for page, data, io in self.load_ahead(pages, self.prefetch):
+                yield self.work(page, data, io)
+            return
+
+        import concurrent.futures
+
+        workers = jobs or os.cpu_count() or 1
+        if pool == "thread":
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            chunksize = 1
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, len(pages) // (workers * 4))
+
+        with executor:
+            if pool == "thread":
+                # Threads share the include cache counters already
+                yield from executor.map(self.work, pages, chunksize=chunksize)
+                return
+
+            for lines, info in executor.map(self.work, pages, chunksize=chunksize):
+                self.include_stats.update(info["includes"])
+                yield lines, info
@@ -0,0 +1,120 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# profiler.py - collects the timings reported by MkDocsCombiner hooks
+
+import collections
+import json
+import time
+
+
+class Profiler:
+    """Hook for MkDocsCombiner (see MkDocsCombiner.add_hook()) that collects
+    the timings of a build and summarizes them as a table or as a report that
+    can be serialized to JSON.
+
+    Events (the first argument of a hook call) are "config" (loading the
+    config file), "read" (loading a page file), "page" (running the per-page
+    filters on a page), "filter" (one filter, on one page or on the whole
+    document), "write" (writing an output file) and "html" (to_html()).
+    """
+
+    EVENTS = ("config", "read", "page", "filter", "write", "html")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forgets everything collected so far"""
+        self.start = None
+        self.end = None
+        self.totals = collections.OrderedDict()  # event -> [seconds, lines, calls]
+        self.pages = collections.OrderedDict()  # page -> [seconds, read, lines]
+        self.filters = collections.OrderedDict()  # filter -> [seconds, lines, calls]
+
+    def __call__(self, event, name, seconds, lines=None):
+        self.end = time.perf_counter()
+        if self.start is None:
+            self.start = self.end - seconds
+
+        total = self.totals.setdefault(event, [0.0, 0, 0])
+        total[0] += seconds
+        total[1] += lines or 0
+        total[2] += 1
+
+        if event == "read":
+            self.pages.setdefault(name, [0.0, 0.0, 0])[1] += seconds
+        elif event == "page":
+            page = self.pages.setdefault(name, [0.0, 0.0, 0])
+            page[0] += seconds
+            page[2] += lines or 0
+        elif event == "filter":
+            f = self.filters.setdefault(name, [0.0, 0, 0])
+            f[0] += seconds
+            f[1] += lines or 0
+            f[2] += 1
+
+    def report(self):
+        """Returns everything collected as a dict of plain values"""
+        wall = self.end - self.start if self.start is not None else 0.0
+        return {
+            "wall": wall,
+            "totals": {
+                event: {"seconds": seconds, "lines": lines, "calls": calls}
+                for event, (seconds, lines, calls) in self.totals.items()
+            },
+            "pages": [
+                {"page": name, "seconds": seconds, "read": read, "lines": lines}
+                for name, (seconds, read, lines) in self.pages.items()
+            ],
+            "filters": [
+                {"filter": name, "seconds": seconds, "lines": lines, "calls": calls}
+                for name, (seconds, lines, calls) in self.filters.items()
+            ],
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+    def summary(self, top=10):
+        """Returns a table of the totals, the filters and the `top` slowest
+        pages as a list of lines"""
+        lines = [f"{'phase':<40} {'seconds':>9} {'lines':>9} {'calls':>7}"]
+        for event in self.EVENTS:
+            if event in self.totals:
+                seconds, count, calls = self.totals[event]
+                lines.append(f"{event:<40} {seconds:>9.3f} {count:>9} {calls:>7}")
+        if self.start is not None:
+            lines.append(f"{'wall':<40} {self.end - self.start:>9.3f}")
+
+        if self.filters:
+            lines.append("")
+            lines.append(f"{'filter':<40} {'seconds':>9} {'lines':>9} {'calls':>7}")
+            for name, (seconds, count, calls) in sorted(
+                self.filters.items(), key=lambda item: -item[1][0]
+            ):
+                lines.append(f"{name[:40]:<40} {seconds:>9.3f} {count:>9} {calls:>7}")
+
+        if self.pages:
+            lines.append("")
+            lines.append(f"{'page':<40} {'seconds':>9} {'lines':>9} {'read':>7}")
+            for name, (seconds, read, count) in sorted(
+                self.pages.items(), key=lambda item: -(item[1][0] + item[1][1])
+            )[:top]:
+                lines.append(f"{name[-40:]:<40} {seconds:>9.3f} {count:>9} {read:>7.3f}")
+
+        return lines
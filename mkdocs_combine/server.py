@@ -0,0 +1,291 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# server.py - answers combine and HTML requests from warm, long-lived combiners
+
+import collections
+import concurrent.futures
+import http.server
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+import urllib.parse
+
+import mkdocs_combine.mkdocs_combiner
+from mkdocs_combine.cache import file_stamp, package_version, site_cache_dir
+from mkdocs_combine.exceptions import FatalError
+
+
+class Site:
+    """A site the server has combined before: its combiner, with the config,
+    the page cache (in memory) and the HTML renderer loaded, and the stamps
+    of the files its last build was made from. All work on a site runs on its
+    own worker thread, one request at a time, so the Markdown instances of
+    the HTML renderer (one per thread) are reused. A relative cache_dir in
+    `options` is taken to be relative to the site's config file."""
+
+    def __init__(self, config_file, options):
+        options = dict(options)
+        options["cache_dir"] = site_cache_dir(options.get("cache_dir"), config_file)
+        self.worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            self.combiner = self.worker.submit(
+                mkdocs_combine.mkdocs_combiner.MkDocsCombiner,
+                config_file=config_file,
+                memory_cache=True,
+                **options,
+            ).result()
+        except BaseException:
+            self.worker.shutdown(wait=False)
+            raise
+        self.config_stamp = file_stamp(config_file)
+        self.stamps = None
+        self.html = None
+
+    def changed(self):
+        """Tells whether one of the files the last build was made from changed
+        (or there was no build yet)"""
+        if self.stamps is None:
+            return True
+        return any(file_stamp(path) != stamp for path, stamp in self.stamps.items())
+
+    def combine(self):
+        """Returns the combined document, built again only if one of its
+        files changed"""
+        if not self.changed():
+            return self.combiner.combined_md_lines
+
+        config_stamp = file_stamp(self.combiner.config_file)
+        if config_stamp != self.config_stamp:
+            self.combiner.load_config()
+            self.config_stamp = config_stamp
+
+        started = time.time_ns()
+        self.stamps = None
+        self.html = None
+        lines = self.combiner.combine()
+
+        inputs = self.combiner.dependencies()
+        paths = [inputs["config"]] + inputs["pages"] + inputs["includes"]
+        stamps = {path: file_stamp(path) for path in paths}
+        # A file changed while it was being read: build again next time.
+        # Missing files (included files that don't exist yet) are stamped
+        # None, so creating them triggers a build.
+        if not any(stamp and stamp[0] >= started for stamp in stamps.values()):
+            self.stamps = stamps
+        return lines
+
+    def to_html(self):
+        """Returns the HTML of the combined document, rendered again only if
+        one of its files changed"""
+        self.combine()
+        if self.html is None or self.stamps is None:
+            self.html = self.combiner.to_html()
+        return self.html
+
+    def submit(self, method):
+        """Runs the method named `method` on the site's worker thread; returns
+        a Future of its result. Raises RuntimeError if the site was closed."""
+        return self.worker.submit(getattr(self, method))
+
+    def close(self):
+        """Stops the worker thread once the work already submitted is done"""
+        self.worker.shutdown(wait=False)
+
+
+class CombineServer:
+    """Combines sites on request, keeping a Site for the `max_sites` config
+    files asked for last (default: 16). The other `options` are passed to
+    MkDocsCombiner for every site."""
+
+    def __init__(self, **options):
+        self.max_sites = options.pop("max_sites", 16)
+        self.options = options
+        self.sites = collections.OrderedDict()
+        self.loading = {}  # config file -> Future of the Site being loaded
+        self.lock = threading.Lock()
+
+    def site(self, config_file):
+        """Returns the Site of `config_file`, loading it if needed. Sites are
+        loaded outside the lock, so a slow one doesn't hold up requests for
+        the others; requests for a site being loaded wait for it."""
+        config_file = os.path.abspath(config_file)
+        with self.lock:
+            site = self.sites.get(config_file)
+            if site is not None:
+                self.sites.move_to_end(config_file)
+                return site
+            future = self.loading.get(config_file)
+            if future is None:
+                future = self.loading[config_file] = concurrent.futures.Future()
+                loading = True
+            else:
+                loading = False
+        if not loading:
+            return future.result()
+
+        try:
+            site = Site(config_file, self.options)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[config_file]
+            future.set_exception(e)
+            raise
+
+        evicted = []
+        with self.lock:
+            del self.loading[config_file]
+            self.sites[config_file] = site
+            while len(self.sites) > self.max_sites:
+                evicted.append(self.sites.popitem(last=False)[1])
+        future.set_result(site)
+        for old in evicted:
+            old.close()
+        return site
+
+    def run(self, config_file, method):
+        """Runs the method named `method` of the site of `config_file` on its
+        worker thread and returns its result"""
+        while True:
+            site = self.site(config_file)
+            try:
+                future = site.submit(method)
+            except RuntimeError:
+                # Evicted since: load it again
+                continue
+            return future.result()
+
+    def combine(self, config_file):
+        """Returns the combined document of the site as text"""
+        return "\n".join(self.run(config_file, "combine"))
+
+    def to_html(self, config_file):
+        """Returns the HTML of the site"""
+        return self.run(config_file, "to_html")
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Answers GET /combine and GET /html, for the config file given as the
+    "config" query parameter (default: the server's config file). Only config
+    files below the directory of the server's config file or on its list of
+    allowed config files are served; others get 403."""
+
+    server_version = f"mkdocscombine/{package_version()}"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        config_file = query.get("config", [self.server.config_file])[0]
+        combine_server = self.server.combine_server
+        if not self.server.config_allowed(config_file):
+            message = f"Config file not allowed: {config_file}\n"
+            self.respond(403, "text/plain", message)
+            return
+        try:
+            if url.path == "/combine":
+                text = combine_server.combine(config_file)
+                encoding = combine_server.options.get("encoding", "utf-8")
+                self.respond(200, "text/markdown", text, encoding)
+            elif url.path == "/html":
+                html = combine_server.to_html(config_file)
+                self.respond(200, "text/html", html)
+            else:
+                self.respond(404, "text/plain", f"No such endpoint: {url.path}\n")
+        except FatalError as e:
+            self.respond(500, "text/plain", e.message + "\n")
+        except Exception as e:
+            # A broken site must not take the server down with it
+            message = f"{config_file}: {type(e).__name__}: {e}"
+            print(message, file=sys.stderr)
+            self.respond(500, "text/plain", message + "\n")
+
+    def respond(self, status, content_type, text, encoding="utf-8"):
+        body = text.encode(encoding)
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset={encoding}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of Unix sockets have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Replace the socket of a server that didn't shut down cleanly
+        try:
+            if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                os.remove(self.server_address)
+        except OSError:
+            pass
+        super().server_bind()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+class ConfigCheck:
+    """Tells whether requests may ask for a config file: it has to be below
+    the directory of `config_file` or one of `allowed_configs` (symbolic
+    links resolved, so they can't lead out)"""
+
+    def __init__(self, config_file, allowed_configs=()):
+        self.root = os.path.dirname(os.path.realpath(config_file))
+        self.allowed = {os.path.realpath(path) for path in allowed_configs}
+
+    def __call__(self, config_file):
+        path = os.path.realpath(config_file)
+        if path in self.allowed:
+            return True
+        try:
+            return os.path.commonpath([self.root, path]) == self.root
+        except ValueError:
+            # On another drive
+            return False
+
+
+def make_server(combine_server, **kwargs):
+    """Returns an HTTP server answering requests for `combine_server`, on the
+    Unix socket `socket_path` if given, on `host`:`port` otherwise. Requests
+    without a config file get `config_file`; requests may only ask for config
+    files below its directory or listed in `allowed_configs`."""
+    socket_path = kwargs.get("socket_path", None)
+    if socket_path:
+        httpd = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        address = (kwargs.get("host", "127.0.0.1"), kwargs.get("port", 8000))
+        httpd = http.server.ThreadingHTTPServer(address, RequestHandler)
+    httpd.combine_server = combine_server
+    httpd.config_file = kwargs.get("config_file", "mkdocs.yml")
+    httpd.config_allowed = ConfigCheck(
+        httpd.config_file, kwargs.get("allowed_configs", None) or ()
+    )
+    httpd.verbose = kwargs.get("verbose", False)
+    return httpd
@@ -0,0 +1,86 @@
+# Copyright 2015 Johannes Grassler <johannes@btw23.de>
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# watch.py - polls files and directories for changes
+
+import os
+import time
+
+
+class Watcher:
+    """Polls a set of files and directories (recursively) for changes. Uses
+    plain stat() calls, so it works the same on every platform and
+    filesystem."""
+
+    def __init__(self, paths, interval=0.5, debounce=0.3, ignore=()):
+        self.interval = interval
+        self.debounce = debounce
+        self.ignore = {os.path.abspath(path) for path in ignore}
+        self.watch(paths)
+
+    def watch(self, paths):
+        """Replaces the set of watched paths"""
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.state = self.snapshot()
+
+    def snapshot(self):
+        """Returns a dict mapping every watched file to its mtime and size"""
+        state = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    for name in files:
+                        self.stat(os.path.join(root, name), state)
+            else:
+                self.stat(path, state)
+        return state
+
+    def stat(self, path, state):
+        if path in self.ignore:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        state[path] = (st.st_mtime_ns, st.st_size)
+
+    def changes(self):
+        """Returns the set of files added, removed or modified since the last
+        call and remembers the current state."""
+        state = self.snapshot()
+        changed = {
+            path
+            for path in set(state) | set(self.state)
+            if state.get(path) != self.state.get(path)
+        }
+        self.state = state
+        return changed
+
+    def wait(self):
+        """Blocks until something changed and no further changes happened for
+        `debounce` seconds, then returns all changed files."""
+        changed = set()
+        while not changed:
+            time.sleep(self.interval)
+            changed = self.changes()
+
+        # Collapse bursts of changes (editors writing backup files, git
+        # checkouts...) into a single rebuild.
+        while True:
+            time.sleep(self.debounce)
+            more = self.changes()
+            if not more:
+                return changed
+            changed |= more
@@ -66,7 +66,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=["mkdocs>=1.0.4", "Markdown>=3.0.1", "markdown-include>=0.5.1"],
+    install_requires=["mkdocs>=1.0.4", "Markdown>=3.0.1"],
     entry_points={
         "console_scripts": [
             "mkdocscombine=mkdocs_combine.cli.mkdocscombine:main",
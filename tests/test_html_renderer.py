@@ -0,0 +1,108 @@
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# test_html_renderer.py - checks HtmlRenderer against Markdown on the whole
+# document
+
+import os
+import random
+import tempfile
+import unittest
+
+import markdown
+
+from mkdocs_combine import MkDocsCombiner
+from mkdocs_combine.html_renderer import HtmlRenderer
+
+BLOCKS = [
+    "# Title",
+    "## Sub",
+    "text",
+    "<div>\nopen div",
+    "</div>",
+    "<!-- comment\n\n# inside the comment\n",
+    "-->",
+    "<!-- one line -->",
+    "```\ncode\n\n# not a heading\n```",
+    "[ref]: http://example.com",
+    "see [ref]",
+    "<p>raw</p>",
+    "<hr>",
+    "    indented",
+]
+
+
+def markdown_run(lines, extensions):
+    text = "\n".join(lines)
+    return markdown.markdown(text, extensions=extensions, output_format="html5")
+
+
+class HtmlRendererTest(unittest.TestCase):
+    def check(self, text, extensions):
+        lines = text.split("\n")
+        self.assertEqual(
+            HtmlRenderer(extensions).render(lines),
+            markdown_run(lines, extensions).strip(),
+        )
+
+    def test_matches_markdown(self):
+        rng = random.Random(1)
+        for extensions in (["toc"], ["toc", "footnotes"]):
+            renderer = HtmlRenderer(extensions)
+            for case in range(500):
+                blocks = [rng.choice(BLOCKS) for _ in range(rng.randint(1, 10))]
+                lines = "\n\n".join(blocks).split("\n")
+                self.assertEqual(
+                    renderer.render(lines),
+                    markdown_run(lines, extensions).strip(),
+                    f"case {case}",
+                )
+
+    def test_footnotes(self):
+        self.check("# A\n\ntext[^1]\n\n[^1]: note\n\n# B\n\nmore", ["footnotes"])
+
+    def test_open_html_blocks(self):
+        self.check("# A\n\n<div>\nopen\n\n# B\n\ntext", ["toc"])
+        self.check("# A\n\n<!-- open\n\n# B\n\n-->\n\n# C\n\ntext", ["toc"])
+
+
+class SiteTest(unittest.TestCase):
+    def test_resolve_xrefs(self):
+        # Page titles get their anchor added to their attribute list
+        with tempfile.TemporaryDirectory() as base:
+            os.mkdir(os.path.join(base, "docs"))
+            nav = []
+            for i in range(6):
+                name = f"page{i}.md"
+                nav.append(f"  - Page {i}: {name}")
+                with open(os.path.join(base, "docs", name), "w") as f:
+                    f.write(f"# Heading\n\nSee [the next page](page{i + 1}.md).\n")
+            config_file = os.path.join(base, "mkdocs.yml")
+            with open(config_file, "w") as f:
+                f.write("site_name: Test\nmarkdown_extensions:\n  - toc\nnav:\n")
+                f.write("\n".join(nav) + "\n")
+
+            c = MkDocsCombiner(config_file=config_file, resolve_xrefs=True)
+            lines = c.combine()
+            renderer = c.get_html_renderer()
+            spans, indexes = renderer.split(lines)
+            self.assertEqual(len(spans), 6)
+            c.to_html()
+            self.assertEqual(
+                c.html_bare, markdown_run(lines, renderer.extensions).strip()
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
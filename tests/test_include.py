@@ -0,0 +1,213 @@
+# Copyright 2017 Adam Twardoch <adam+github@twardoch.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# test_include.py - checks IncludeFilter, and that it expands includes like
+# markdown_include does
+#
+# Run with "python -m unittest discover tests", once with markdown_include
+# 0.5.x and once with 0.6 or later installed.
+
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from mkdocs_combine.exceptions import FatalError
+from mkdocs_combine.filters import include
+
+try:
+    import markdown_include.include as incl
+except ImportError:
+    incl = None
+
+LINES = [
+    "text",
+    "",
+    "  indented",
+    "# heading",
+    "{!f%d.md!}",
+    "before {!f%d.md!} after",
+    "{!f%d.md!}{!f%d.md!} tail",
+    "{!missing.md!}",
+    "x {!missing.md!} y {!f%d.md!}",
+]
+LINES_OPTION = ["{!f%d.md!lines=1 2-3}", "a {!f%d.md!lines=2} b", "{!f%d.md!lines=3-1}"]
+
+
+def random_lines(rng, count, first, lines_option):
+    """Returns `count` random lines that include files f<first> and later"""
+    choices = LINES + (LINES_OPTION if lines_option else [])
+    lines = []
+    for _ in range(count):
+        line = rng.choice(choices)
+        if "%d" in line:
+            if first > 5:
+                continue
+            line = line % tuple(
+                rng.randint(first, 5) for _ in range(line.count("%d"))
+            )
+        lines.append(line)
+    return lines
+
+
+def write_files(base, rng, lines_option):
+    # File i only includes files after it, so there are no cycles
+    for i in range(6):
+        lines = random_lines(rng, rng.randint(0, 4), i + 1, lines_option)
+        text = "\n".join(lines) + rng.choice(["", "\n"])
+        with open(os.path.join(base, f"f{i}.md"), "w") as f:
+            f.write(text)
+
+
+def markdown_include_run(base, lines):
+    configs = incl.MarkdownInclude(configs={"base_path": base}).getConfigs()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return incl.IncludePreprocessor(None, configs).run(list(lines))
+
+
+def include_filter_run(base, lines, legacy=include.LEGACY):
+    f = include.IncludeFilter(base_path=base, legacy=legacy)
+    with contextlib.redirect_stderr(io.StringIO()):
+        return f.run(lines)
+
+
+@unittest.skipIf(incl is None, "markdown_include is not installed")
+class MarkdownIncludeTest(unittest.TestCase):
+    def test_matches_installed_markdown_include(self):
+        rng = random.Random(1)
+        for case in range(100):
+            with tempfile.TemporaryDirectory() as base:
+                write_files(base, rng, not include.LEGACY)
+                lines = random_lines(rng, rng.randint(1, 6), 0, not include.LEGACY)
+                try:
+                    expected = markdown_include_run(base, lines)
+                except (IndexError, ValueError):
+                    # Lines asked for that aren't there
+                    with self.assertRaises(FatalError, msg=f"case {case}"):
+                        include_filter_run(base, lines)
+                    continue
+                self.assertEqual(
+                    include_filter_run(base, lines), expected, f"case {case}"
+                )
+
+
+class IncludeFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.base = self.dir.name
+        for name, text in [
+            ("a.md", "one\ntwo\nthree\n"),
+            ("b.md", "  b {!a.md!} end\n"),
+            ("empty.md", ""),
+        ]:
+            with open(os.path.join(self.base, name), "w") as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_filter(self, lines, legacy):
+        return include_filter_run(self.base, lines, legacy)
+
+    def test_legacy(self):
+        self.assertEqual(
+            self.run_filter(["x {!a.md!} y", "{!b.md!}"], legacy=True),
+            ["x one", "two", "three y", "  b one", "two", "three end"],
+        )
+        # Text after the next statement is lost
+        self.assertEqual(
+            self.run_filter(["{!a.md!} m {!empty.md!} n"], legacy=True),
+            ["one", "two", "three m "],
+        )
+        # The lines option is not known
+        self.assertEqual(
+            self.run_filter(["{!a.md!lines=2}"], legacy=True), ["{!a.md!lines=2}"]
+        )
+
+    def test_current(self):
+        self.assertEqual(
+            self.run_filter(["x {!a.md!} y", "{!b.md!}"], legacy=False),
+            ["x one", "two", "three y", "b one", "two", "three end"],
+        )
+        # The lines of a second statement on the line are repeated, as in
+        # markdown_include
+        self.assertEqual(
+            self.run_filter(["{!a.md!} m {!empty.md!} n"], legacy=False),
+            ["one", "two", "three m  n", "two", "three m  n"],
+        )
+        self.assertEqual(
+            self.run_filter(["{!a.md!lines=3 1-2}"], legacy=False),
+            ["three", "one", "two"],
+        )
+        # A line that expands to nothing hides the line after it
+        self.assertEqual(
+            self.run_filter(["{!empty.md!}", "{!a.md!}", "z"], legacy=False),
+            ["{!a.md!}", "z"],
+        )
+
+    def write(self, name, text):
+        with open(os.path.join(self.base, name), "w") as f:
+            f.write(text)
+
+    def test_cycle(self):
+        self.write("x.md", "{!y.md!}\n")
+        self.write("y.md", "y\n{!x.md!}\n")
+        for legacy in (True, False):
+            with self.assertRaisesRegex(FatalError, "Include cycle: .*x.md -> "):
+                self.run_filter(["{!x.md!}"], legacy)
+
+    def test_max_depth(self):
+        for i in range(4):
+            self.write(f"c{i}.md", f"{{!c{i + 1}.md!}}\n")
+        self.write("c4.md", "end\n")
+        for legacy in (True, False):
+            f = include.IncludeFilter(base_path=self.base, legacy=legacy, max_depth=5)
+            self.assertEqual(f.run(["{!c0.md!}"]), ["end"])
+            f = include.IncludeFilter(base_path=self.base, legacy=legacy, max_depth=4)
+            with self.assertRaisesRegex(FatalError, "deeper than 4 levels"):
+                f.run(["{!c0.md!}"])
+
+    def test_stats(self):
+        for legacy in (True, False):
+            f = include.IncludeFilter(base_path=self.base, legacy=legacy)
+            f.run(["{!b.md!}", "{!a.md!}"])
+            # b.md and the a.md it includes are read once
+            self.assertEqual(f.stats, {"misses": 2, "hits": 1})
+            f.run(["{!b.md!}"])
+            self.assertEqual(f.stats, {"misses": 2, "hits": 2})
+
+            # A change to a.md invalidates b.md too
+            path = os.path.join(self.base, "a.md")
+            stamp = time.time() + 10
+            os.utime(path, (stamp, stamp))
+            self.assertEqual(
+                f.run(["{!b.md!}"]),
+                self.run_filter(["{!b.md!}"], legacy),
+            )
+            self.assertEqual(f.stats, {"misses": 4, "hits": 2})
+
+    def test_missing_file_is_a_dependency(self):
+        for legacy in (True, False):
+            deps = []
+            f = include.IncludeFilter(base_path=self.base, legacy=legacy)
+            with contextlib.redirect_stderr(io.StringIO()):
+                f.run(["{!new.md!}"], deps)
+            self.assertEqual(deps, [os.path.join(self.base, "new.md")])
+
+
+if __name__ == "__main__":
+    unittest.main()